@@ -9,7 +9,11 @@ Developed by: Kuldeep Singh Rautela
 Contact: rautela.ks.job@gmail.com for commercial licensing
 """
 
+import hashlib
 import json
+import re
+import threading
+from collections import OrderedDict
 import requests
 from typing import Dict, Any, Optional
 from loguru import logger
@@ -17,6 +21,12 @@ import time
 import os
 from abc import ABC, abstractmethod
 
+# Phrases that mark the start of explanatory text after the SQL, matched in one pass
+EXPLANATION_START_RE = re.compile(
+    r"this query|explanation|note:|the above query|here is|this will|the result|this sql",
+    re.IGNORECASE
+)
+
 
 class BaseLLMAdapter(ABC):
     """Base class for LLM adapters."""
@@ -38,8 +48,17 @@ class GroqAdapter(BaseLLMAdapter):
     def __init__(self, 
                  api_key: Optional[str] = None,
                  model_name: str = "meta-llama/llama-4-maverick-17b-128e-instruct",
-                 base_url: str = "https://api.groq.com/openai/v1"):
-        """Initialize Groq adapter."""
+                 base_url: str = "https://api.groq.com/openai/v1",
+                 response_cache_size: int = 0):
+        """Initialize Groq adapter.
+        
+        Args:
+            api_key: Groq API key, read from GROQ_API_KEY when not given
+            model_name: Groq model name
+            base_url: Groq OpenAI-compatible API base URL
+            response_cache_size: Number of prompt -> SQL results kept in memory (0 disables the cache);
+                entries are added by the caller with cache_response once the SQL is validated
+        """
         
         # Get API key from parameter or environment
         self.api_key = api_key or os.getenv("GROQ_API_KEY")
@@ -51,6 +70,11 @@ class GroqAdapter(BaseLLMAdapter):
         self.base_url = base_url
         self.chat_url = f"{self.base_url}/chat/completions"
         
+        # Identical prompts get validated SQL generated for them earlier instead of a new API call
+        self.response_cache_size = response_cache_size
+        self._response_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+        
         logger.info(f"Initializing Groq adapter")
         logger.info(f"   Model: {model_name}")
         logger.info(f"   API URL: {base_url}")
@@ -103,6 +127,12 @@ class GroqAdapter(BaseLLMAdapter):
             logger.error(f"GROQ: API key not configured")
             return "SELECT 'Groq API key not configured' as error_message;"
         
+        cache_key = self._response_cache_key(prompt)
+        cached_sql = self._get_cached_response(cache_key)
+        if cached_sql is not None:
+            logger.info(f"GROQ: Returning cached SQL for identical prompt")
+            return cached_sql
+        
         try:
             # Format prompt for Llama-2-70B via Groq
             logger.info(f"GROQ: Formatting prompt for Groq API")
@@ -171,7 +201,7 @@ class GroqAdapter(BaseLLMAdapter):
                 logger.info(f"GROQ: Raw response length: {len(generated_text)} characters")
                 logger.info(f"GROQ: Raw response preview: {generated_text[:200]}...")
                 
-                if not generated_text or len(generated_text.strip()) == 0:
+                if not generated_text or generated_text.isspace():
                     logger.error(f"GROQ: Empty response from API")
                     logger.error(f"GROQ: Full response data: {response_data}")
                     return "SELECT 'Empty response from Groq API' as error_message;"
@@ -213,6 +243,37 @@ class GroqAdapter(BaseLLMAdapter):
             logger.error(f"Groq generation failed: {e}")
             return f"SELECT 'Error: {str(e)[:100]}' as error_message;"
     
+    def _response_cache_key(self, prompt: str) -> str:
+        """Digest of the model name and prompt, used as the response cache key."""
+        return hashlib.blake2b(f"{self.model_name}\0{prompt}".encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _get_cached_response(self, cache_key: str) -> Optional[str]:
+        """Return the cached SQL for a key, or None if it is not cached."""
+        with self._response_cache_lock:
+            sql_query = self._response_cache.get(cache_key)
+            if sql_query is not None:
+                self._response_cache.move_to_end(cache_key)
+            return sql_query
+    
+    def cache_response(self, prompt: str, sql_query: str):
+        """Cache SQL for a prompt, evicting the least recently used entry when full.
+        
+        Called once the SQL has passed validation, so unchecked generations are never replayed.
+        """
+        if self.response_cache_size <= 0 or sql_query.endswith("as error_message;"):
+            return
+        cache_key = self._response_cache_key(prompt)
+        with self._response_cache_lock:
+            self._response_cache[cache_key] = sql_query
+            self._response_cache.move_to_end(cache_key)
+            if len(self._response_cache) > self.response_cache_size:
+                self._response_cache.popitem(last=False)
+    
+    def invalidate_response(self, prompt: str):
+        """Drop any cached SQL for a prompt."""
+        with self._response_cache_lock:
+            self._response_cache.pop(self._response_cache_key(prompt), None)
+    
     def _format_prompt_for_groq(self, prompt: str) -> list:
         """Format the prompt for Groq's chat format - pass through the Vector DB prompt as-is."""
         
@@ -365,19 +426,18 @@ A: SELECT firstname, lastname, email FROM spt_identity WHERE inactive = 0;"""
             if not line:
                 continue
                 
+            line_upper = line.upper()
+            
             # Start collecting from SELECT
-            if line.upper().startswith('SELECT') or found_select:
+            if found_select or line_upper.startswith('SELECT'):
                 found_select = True
                 
                 # Stop at explanatory text
-                if any(phrase in line.lower() for phrase in [
-                    'this query', 'explanation', 'note:', 'the above query', 
-                    'here is', 'this will', 'the result', 'this sql'
-                ]):
+                if EXPLANATION_START_RE.search(line):
                     break
                     
                 sql_lines.append(line)
-            elif any(word in line.upper() for word in ['SELECT', 'WITH', 'FROM']):
+            elif 'SELECT' in line_upper or 'WITH' in line_upper or 'FROM' in line_upper:
                 # Catch SELECT that might not be at the start
                 found_select = True
                 sql_lines.append(line)
@@ -49,6 +49,18 @@ sql_generator: Optional[SQLGenerator] = None
 # Removed intelligent_generator - using only sql_generator with Groq
 db_adapter: Optional[MySQLAdapter] = None
 
+# Last formatted timestamp, reused for every call within the same second
+_last_timestamp = [0, ""]
+
+
+def _now_str() -> str:
+    """Current local time as 'YYYY-MM-DD HH:MM:SS', formatted at most once per second."""
+    now = int(time.time())
+    if now != _last_timestamp[0]:
+        _last_timestamp[0] = now
+        _last_timestamp[1] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+    return _last_timestamp[1]
+
 
 # Pydantic models for request/response
 class QueryRequest(BaseModel):
@@ -198,7 +210,7 @@ async def health_check(generator: SQLGenerator = Depends(get_sql_generator)):
         
         return HealthResponse(
             status=health_result["overall_status"],
-            timestamp=time.strftime("%Y-%m-%d %H:%M:%S"),
+            timestamp=_now_str(),
             components=health_result["components"],
             issues=health_result["issues"]
         )
@@ -207,7 +219,7 @@ async def health_check(generator: SQLGenerator = Depends(get_sql_generator)):
         logger.error(f"Health check failed: {e}")
         return HealthResponse(
             status="unhealthy",
-            timestamp=time.strftime("%Y-%m-%d %H:%M:%S"),
+            timestamp=_now_str(),
             components={"error": "health_check_failed"},
             issues=[str(e)]
         )
@@ -11,6 +11,20 @@ from loguru import logger
 import chromadb
 from sentence_transformers import SentenceTransformer
 
+# Instructions appended after the table definitions in every final prompt
+PROMPT_INSTRUCTIONS = """Based on these table definitions and the training example, generate the appropriate SQL query for the user's request.
+
+Key points to remember:
+- Always use proper JOINs when accessing multiple tables
+- Include WHERE clauses for active users (i.inactive = 0 for active users)
+- Use DISTINCT when appropriate to avoid duplicates
+- Follow proper MySQL syntax and best practices"""
+
+# Fixed chunks of the final prompt, joined around the retrieved context
+FINAL_PROMPT_TABLES = "\n\nHere are the tables definitions, this will help you to understand the relations:\n\n"
+FINAL_PROMPT_REQUEST = "\n\n" + PROMPT_INSTRUCTIONS + "\n\nUser Request: "
+FINAL_PROMPT_TAIL = "\n\nGenerate the SQL query:\n"
+
 
 class CompleteVectorDBRetriever:
     """Complete Vector DB retriever for all components."""
@@ -19,6 +33,8 @@ class CompleteVectorDBRetriever:
         """Initialize the complete retriever."""
         self.vector_db_client = chromadb.PersistentClient(path="./chromadb")
         self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self._prompt_template: Optional[str] = None
+        self._training_example_texts: Dict[str, str] = {}
         self._initialize_collections()
         
     def _initialize_collections(self):
@@ -37,23 +53,28 @@ class CompleteVectorDBRetriever:
             raise
     
     def step1_get_prompt_template(self, user_query: str) -> Tuple[str, float]:
-        """Step 1: Get prompt template from Vector DB."""
+        """Step 1: Get prompt template from Vector DB.
+        
+        There is a single prompt type, so it is fetched by id once and reused
+        for every query.
+        """
         logger.info(f"Step 1: Getting prompt template for query: '{user_query}'")
         
+        if self._prompt_template:
+            return self._prompt_template, 1.0
+        
         try:
             # Get the MySQL expert prompt (we only have one prompt type)
-            results = self.collections['prompt_templates'].query(
-                query_texts=[user_query],
-                n_results=1,
-                include=['documents', 'distances']
+            results = self.collections['prompt_templates'].get(
+                ids=["mysql_expert_prompt"],
+                include=['documents']
             )
             
-            if results['documents'] and results['documents'][0] and len(results['documents'][0]) > 0:
-                prompt_template = results['documents'][0][0]
-                similarity_score = 1 - results['distances'][0][0]
+            if results['documents']:
+                self._prompt_template = results['documents'][0]
                 
-                logger.info(f"Found prompt template (similarity: {similarity_score:.3f})")
-                return prompt_template, similarity_score
+                logger.info("Found prompt template (exact match)")
+                return self._prompt_template, 1.0
             else:
                 logger.warning("No prompt template found in Vector DB")
                 return "", 0.0
@@ -209,15 +230,32 @@ class CompleteVectorDBRetriever:
             return "Error: Could not retrieve complete context for the query."
         
         # Build table definitions text
-        table_definitions_text = ""
-        for table_name, definition in context["table_definitions"].items():
-            table_definitions_text += f"\n\nCREATE TABLE `{table_name}`:\n{definition}\n"
+        table_definitions_text = "".join(
+            f"\n\nCREATE TABLE `{table_name}`:\n{definition}\n"
+            for table_name, definition in context["table_definitions"].items()
+        )
         
         # Build training example text
         training_example_text = ""
         if context["training_example"]:
-            example = context["training_example"]
-            training_example_text = f"""
+            training_example_text = self._format_training_example(context["training_example"])
+        
+        # Generate final prompt
+        final_prompt = "".join((
+            "\n", context["prompt_template"], "\n\n", training_example_text,
+            FINAL_PROMPT_TABLES, table_definitions_text,
+            FINAL_PROMPT_REQUEST, context["user_query"],
+            FINAL_PROMPT_TAIL,
+        ))
+        
+        logger.info(f"Final prompt generated (length: {len(final_prompt)} characters)")
+        return final_prompt
+    
+    def _format_training_example(self, example: Dict[str, Any]) -> str:
+        """Prompt block for a training example, formatted once per stored example."""
+        key = example["natural_language"]
+        if key not in self._training_example_texts:
+            self._training_example_texts[key] = f"""
 Training Example:
 If a user says - {example["natural_language"]} then this would be query:
 
@@ -227,32 +265,7 @@ Explanation: {example["explanation"]}
 Key Concepts: {', '.join(example["key_concepts"])}
 Difficulty: {example["difficulty"]}
 """
-        
-        # Generate final prompt
-        final_prompt = f"""
-{context["prompt_template"]}
-
-{training_example_text}
-
-Here are the tables definitions, this will help you to understand the relations:
-
-{table_definitions_text}
-
-Based on these table definitions and the training example, generate the appropriate SQL query for the user's request.
-
-Key points to remember:
-- Always use proper JOINs when accessing multiple tables
-- Include WHERE clauses for active users (i.inactive = 0 for active users)
-- Use DISTINCT when appropriate to avoid duplicates
-- Follow proper MySQL syntax and best practices
-
-User Request: {context["user_query"]}
-
-Generate the SQL query:
-"""
-        
-        logger.info(f"Final prompt generated (length: {len(final_prompt)} characters)")
-        return final_prompt
+        return self._training_example_texts[key]
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get collection statistics."""
@@ -13,6 +13,10 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Model the Chroma collections are embedded with: Chroma's default embedding function
+# and populate_vector_db both use it, so query embeddings must come from it too
+COLLECTION_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
 
 class DatabaseConfig(BaseSettings):
     """Database configuration settings."""
@@ -40,6 +44,7 @@ class LLMConfig(BaseSettings):
     # Generation parameters
     temperature: float = Field(default=0.1, description="Temperature for text generation")
     max_tokens: int = Field(default=1000, description="Maximum tokens to generate")
+    response_cache_size: int = Field(default=0, description="Validated SQL kept per identical prompt; 0 disables the response cache")
     
     class Config:
         env_prefix = "LLM_"
@@ -50,9 +55,17 @@ class VectorDBConfig(BaseSettings):
     
     persist_directory: str = Field(default="./chromadb", description="ChromaDB persistence directory")
     collection_name: str = Field(default="schema_embeddings", description="Collection name for schema embeddings")
-    embedding_model: str = Field(default="all-MiniLM-L6-v2", description="Sentence transformer model for embeddings")
+    embedding_model: str = Field(default="all-MiniLM-L6-v2", description="Sentence transformer for the SQL semantic cache; collections and queries are always embedded with COLLECTION_EMBEDDING_MODEL")
+    onnx_model_path: Optional[str] = Field(default=None, description="Directory of an ONNX export of the embedding model, used for CPU encoding")
     top_k: int = Field(default=5, description="Number of top similar chunks to retrieve")
     
+    # HNSW index parameters, applied when a collection is created
+    hnsw_space: str = Field(default="cosine", description="HNSW distance function: cosine, l2 or ip")
+    hnsw_m: int = Field(default=32, description="HNSW graph links per node")
+    hnsw_construction_ef: int = Field(default=128, description="HNSW candidate list size while building")
+    hnsw_search_ef: int = Field(default=64, description="HNSW candidate list size while querying")
+    result_cache_enabled: bool = Field(default=True, description="Reuse schema retrieval results for near-identical queries")
+    
     class Config:
         env_prefix = "VECTOR_"
 
@@ -69,6 +82,16 @@ class AppConfig(BaseSettings):
     schema_file: str = Field(default="schema.json", description="Auto-generated schema file")
     manual_schema_file: str = Field(default="schema_manual.json", description="Manual schema file")
     
+    # Semantic cache of generated SQL; near-duplicate questions reuse an earlier answer
+    semantic_cache_enabled: bool = Field(default=False, description="Reuse SQL generated for semantically similar queries")
+    semantic_cache_threshold: float = Field(default=0.87, description="Minimum cosine similarity for a semantic cache hit")
+    semantic_cache_size: int = Field(default=1024, description="Maximum number of cached queries")
+    semantic_cache_path: Optional[str] = Field(default=None, description="Path prefix for persisting the semantic cache")
+    semantic_cache_save_every: int = Field(default=64, description="New entries between writes of the persisted semantic cache")
+    semantic_cache_lsh_tables: int = Field(default=0, description="LSH hash tables for semantic cache lookups; 0 scans every entry")
+    semantic_cache_lsh_bits: int = Field(default=16, description="Hyperplanes per semantic cache LSH table")
+    semantic_cache_faiss: bool = Field(default=False, description="Search the semantic cache with FAISS when installed")
+    
     class Config:
         env_prefix = "APP_"
 
@@ -4,11 +4,23 @@ IIQ Prompt Templates - Single MySQL Expert Prompt with 310+ Patterns
 Contains the single prompt template and all 310+ patterns for matching
 """
 
-from typing import Dict, Any, List
+from typing import Callable, Dict, Any, List
 from sentence_transformers import SentenceTransformer
 import numpy as np
 
 
+MYSQL_EXPERT_PROMPT = """You are an MYSQL expert, you need to write query for me in mysql.
+
+You do have three tables:
+spt_identity - this table stores user data
+spt_application - this stores applications metadata
+spt_link - this stores account for the user for that application.
+
+A user can have mutiple rows in link table for a given application. If a user does have two accounts for an application, it means user would have two rows in spt_link table for the same application.
+
+If a system does have 15 applications, it means only 15 rows are possible in spt_application table, if a system does have 100 users then in spt_identity only 100 rows are possible, if 100 users in total does have 1000 accounts, the there would be 1000 rows in spt_link table, those 1000 rows many belong to different application, it depend on which account is for which application."""
+
+
 class IIQPromptTemplates:
     """Single prompt template with all the patterns for matching."""
     
@@ -16,25 +28,30 @@ class IIQPromptTemplates:
         """Initialize the prompt template and all patterns."""
         self.prompt_template = self._get_mysql_expert_prompt()
         self.patterns = self._get_all_patterns()
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
         
-        # Pre-compute embeddings for all patterns
-        print(f"Loading {len(self.patterns)} patterns and computing embeddings...")
-        self.pattern_embeddings = self._compute_pattern_embeddings()
-        print(f"Loaded {len(self.patterns)} patterns successfully!")
+        # Model and embeddings are only needed for pattern matching - load on first use
+        self._model = None
+        self._pattern_embeddings = None
+    
+    @property
+    def embedding_model(self) -> SentenceTransformer:
+        """Sentence transformer used for pattern matching, loaded on first access."""
+        if self._model is None:
+            self._model = SentenceTransformer('all-MiniLM-L6-v2')
+        return self._model
+    
+    @property
+    def pattern_embeddings(self) -> np.ndarray:
+        """Pattern embeddings, computed on first access."""
+        if self._pattern_embeddings is None:
+            print(f"Loading {len(self.patterns)} patterns and computing embeddings...")
+            self._pattern_embeddings = self._compute_pattern_embeddings()
+            print(f"Loaded {len(self.patterns)} patterns successfully!")
+        return self._pattern_embeddings
         
     def _get_mysql_expert_prompt(self) -> str:
         """Get the single MySQL expert prompt."""
-        return """You are an MYSQL expert, you need to write query for me in mysql.
-
-You do have three tables:
-spt_identity - this table stores user data
-spt_application - this stores applications metadata
-spt_link - this stores account for the user for that application.
-
-A user can have mutiple rows in link table for a given application. If a user does have two accounts for an application, it means user would have two rows in spt_link table for the same application.
-
-If a system does have 15 applications, it means only 15 rows are possible in spt_application table, if a system does have 100 users then in spt_identity only 100 rows are possible, if 100 users in total does have 1000 accounts, the there would be 1000 rows in spt_link table, those 1000 rows many belong to different application, it depend on which account is for which application."""
+        return MYSQL_EXPERT_PROMPT
     
     def _get_all_patterns(self) -> List[Dict[str, Any]]:
         """Get all 310+ patterns for user/application queries."""
@@ -185,20 +202,31 @@ If a system does have 15 applications, it means only 15 rows are possible in spt
     def build_prompt_with_context(self, query: str, schema_context: str = "", 
                                  training_context: str = "") -> str:
         """Build prompt with additional context."""
-        prompt = self.prompt_template
+        return self.compile_for(schema_context, training_context)(query)
+    
+    def compile_for(self, schema_context: str = "", training_context: str = "") -> Callable[[str], str]:
+        """Return a function building the prompt for a query with fixed context.
+        
+        Everything before the query is joined once here, so callers serving
+        many queries against the same context pay one concatenation per prompt.
+        """
+        parts = [self.prompt_template]
         
         # Add schema context if provided
         if schema_context:
-            prompt += f"\n\n## DATABASE SCHEMA INFORMATION:\n\n{schema_context}\n"
+            parts.extend(("\n\n## DATABASE SCHEMA INFORMATION:\n\n", schema_context, "\n"))
         
         # Add training context if provided
         if training_context:
-            prompt += f"\n\n## TRAINING EXAMPLES:\n\n{training_context}\n"
+            parts.extend(("\n\n## TRAINING EXAMPLES:\n\n", training_context, "\n"))
+        
+        parts.append("\n\nNatural Language Query: ")
+        prefix = "".join(parts)
         
-        # Add query
-        prompt += f"\n\nNatural Language Query: {query}\n\nGenerate the MySQL SELECT query:"
+        def build(query: str) -> str:
+            return f"{prefix}{query}\n\nGenerate the MySQL SELECT query:"
         
-        return prompt
+        return build
     
     def get_all_patterns_count(self) -> int:
         """Get the total number of patterns."""
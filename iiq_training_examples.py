@@ -4,23 +4,72 @@ IIQ Training Examples - SQL Generation Patterns
 Contains training examples for different types of SQL queries
 """
 
+import re
+import sys
+from itertools import islice, product
 from typing import Dict, List, Any, Optional
+import numpy as np
 from loguru import logger
 from sentence_transformers import SentenceTransformer
 
+from vector_ops import NUMBA_AVAILABLE, best_match
+
 
 class IIQTrainingExamples:
     """Training examples for SQL generation patterns."""
     
-    def __init__(self):
-        """Initialize training examples."""
+    # Every pattern maps to the same example, so matching is a single
+    # "is this a user_application_access query?" decision against the centroid
+    CENTROID_THRESHOLD = 0.45
+    
+    ACTIONS = ["provide", "give", "generate", "show", "fetch", "get", "list", "display", "retrieve", "return", "find", "search", "query", "select"]
+    
+    USER_TERMS = ["users", "employees", "people", "identities", "personas", "reviewers", "system accounts", "Owners", "Administrators", "Admins", "Adminsitrators", "Owner", "person", "individual", "staff", "worker", "personnel", "members"]
+    
+    # This list is dynamically updated by update_training_examples_from_db.py
+    APP_NAMES = ["Apache DS", "BAPS", "CMDB", "Finance", "OpenDJ", "Trakk", "Workday", "xSign"]
+    
+    def __init__(self, debug: bool = False):
+        """Initialize training examples.
+        
+        Args:
+            debug: Also score every pattern to log which one matched best
+        """
+        self.debug = debug
+        self._centroid = None
         self.example = self._get_single_training_example()
         self.patterns = self._get_all_patterns()
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.pattern_embeddings = self._compute_pattern_embeddings()
+        self._pattern_texts = np.array([p["pattern"] for p in self.patterns], dtype=object)
+        
+        # The per-app pattern shapes are "<action> ... <user term> ... <app name>" - catch
+        # those without an encoder pass; anything else goes through the centroid check
+        self._fast_re = re.compile(
+            r"\b(?:" + "|".join(map(re.escape, self.ACTIONS)) + r")\b.*\b(?:"
+            + "|".join(map(re.escape, self.USER_TERMS)) + r")\b.*\b(?:"
+            + "|".join(map(re.escape, self.APP_NAMES)) + r")\b",
+            re.IGNORECASE
+        )
+        
+        # Model and embeddings are only needed for similarity matching - load on first use
+        self._model = None
+        self._pattern_embeddings = None
         
         logger.info(f"Loaded 1 training example and {len(self.patterns)} patterns")
     
+    @property
+    def embedding_model(self) -> SentenceTransformer:
+        """Sentence transformer used for pattern matching, loaded on first access."""
+        if self._model is None:
+            self._model = SentenceTransformer('all-MiniLM-L6-v2')
+        return self._model
+    
+    @property
+    def pattern_embeddings(self) -> np.ndarray:
+        """Normalized float16 pattern embeddings, computed on first access."""
+        if self._pattern_embeddings is None:
+            self._pattern_embeddings = self._compute_pattern_embeddings()
+        return self._pattern_embeddings
+    
     def _get_single_training_example(self) -> Dict[str, Any]:
         """Get the single training example."""
         return {
@@ -34,107 +83,94 @@ class IIQTrainingExamples:
         }
     
     def _get_all_patterns(self) -> List[Dict[str, Any]]:
-        """Get all patterns that map to this training example - same 260 patterns as prompt templates."""
-        actions = ["provide", "give", "generate", "show", "fetch", "get", "list", "display", "retrieve", "return", "find", "search", "query", "select"]
-        users = ["users", "employees", "people", "identities", "personas", "reviewers", "system accounts", "Owners", "Administrators", "Admins", "Adminsitrators", "Owner", "person", "individual", "staff", "worker", "personnel", "members"]
+        """Get all patterns that map to this training example (50 + 3 x users x app names = 290)."""
+        actions = self.ACTIONS
+        users = self.USER_TERMS
         accounts = ["accounts", "user accounts", "identity accounts", "links", "access", "connections", "provisioned accounts", "account links", "user access", "system access", "permissions", "entitlements"]
         apps = ["applications", "apps", "systems", "target systems", "connected apps", "platforms", "services", "tools", "software", "environments", "programs", "solutions"]
+        app_names = self.APP_NAMES
         
-        # This list is dynamically updated by update_training_examples_from_db.py
-        app_names = ["Apache DS", "BAPS", "CMDB", "Finance", "OpenDJ", "Trakk", "Workday", "xSign"]
+        # Tokens repeat across hundreds of patterns - share one copy of each
+        actions, users, accounts, apps, app_names = (
+            [sys.intern(token) for token in tokens]
+            for tokens in (actions, users, accounts, apps, app_names)
+        )
         
-        patterns = []
-        pattern_id = 1
+        first_batch = 50  # Limit first batch
+        per_app_shapes = [
+            "show me {user} with {app_name} access",
+            "find {user} who have {app_name}",
+            "list {user} in {app_name}",
+        ]
+        total = first_batch + len(per_app_shapes) * len(users[:10]) * len(app_names[:10])
+        patterns: List[Optional[Dict[str, Any]]] = [None] * total
+        idx = 0
         
         # Pattern 1: Action + users + accounts + for + apps
-        for action in actions[:10]:
-            for user in users[:10]:
-                for account in accounts[:5]:
-                    for app in apps[:5]:
-                        if pattern_id > 50:  # Limit first batch
-                            break
-                        pattern_text = f"{action} me all {user} {account} for {app}"
-                        patterns.append({
-                            "id": f"training_pattern_{pattern_id}",
-                            "pattern": pattern_text,
-                            "example": self.example,
-                            "pattern_type": "user_application_access"
-                        })
-                        pattern_id += 1
-                    if pattern_id > 50:
-                        break
-                if pattern_id > 50:
-                    break
-            if pattern_id > 50:
-                break
+        combos = product(actions[:10], users[:10], accounts[:5], apps[:5])
+        for action, user, account, app in islice(combos, first_batch):
+            patterns[idx] = {
+                "id": f"training_pattern_{idx + 1}",
+                "pattern": sys.intern(f"{action} me all {user} {account} for {app}"),
+                "example": self.example,
+                "pattern_type": "user_application_access"
+            }
+            idx += 1
         
         # Pattern 2: Users + with + app_name + access
-        for user in users[:10]:
-            for app_name in app_names[:10]:
-                patterns.append({
-                    "id": f"training_pattern_{pattern_id}",
-                    "pattern": f"show me {user} with {app_name} access",
-                    "example": self.example,
-                    "pattern_type": "user_application_access",
-                    "app_type": app_name
-                })
-                pattern_id += 1
-        
         # Pattern 3: Find + users + who + have + app_name
-        for user in users[:10]:
-            for app_name in app_names[:10]:
-                patterns.append({
-                    "id": f"training_pattern_{pattern_id}",
-                    "pattern": f"find {user} who have {app_name}",
-                    "example": self.example,
-                    "pattern_type": "user_application_access",
-                    "app_type": app_name
-                })
-                pattern_id += 1
-        
         # Pattern 4: List + users + in + app_name
-        for user in users[:10]:
-            for app_name in app_names[:10]:
-                patterns.append({
-                    "id": f"training_pattern_{pattern_id}",
-                    "pattern": f"list {user} in {app_name}",
+        for template in per_app_shapes:
+            for user, app_name in product(users[:10], app_names[:10]):
+                patterns[idx] = {
+                    "id": f"training_pattern_{idx + 1}",
+                    "pattern": sys.intern(template.format(user=user, app_name=app_name)),
                     "example": self.example,
                     "pattern_type": "user_application_access",
                     "app_type": app_name
-                })
-                pattern_id += 1
+                }
+                idx += 1
         
         return patterns
     
-    def _compute_pattern_embeddings(self) -> List[List[float]]:
-        """Pre-compute embeddings for all patterns."""
-        pattern_texts = [p["pattern"] for p in self.patterns]
-        return self.embedding_model.encode(pattern_texts)
+    def _compute_pattern_embeddings(self) -> np.ndarray:
+        """Pre-compute normalized embeddings for all patterns and their centroid.
+        
+        The pattern matrix is stored as float16 to halve its footprint; the
+        centroid stays float32 since it is used on every query.
+        """
+        mat = np.asarray(self.embedding_model.encode(self._pattern_texts.tolist(), normalize_embeddings=True), dtype=np.float32)
+        
+        self._centroid = mat.mean(axis=0)
+        self._centroid /= np.linalg.norm(self._centroid)
+        
+        if self.debug and NUMBA_AVAILABLE:
+            # Pay the JIT compile cost here rather than on the first query
+            best_match(mat, self._centroid)
+        return mat.astype(np.float16)
     
     def get_example_for_query(self, query: str) -> Optional[Dict[str, Any]]:
-        """Find the best matching pattern and return the training example."""
-        query_embedding = self.embedding_model.encode([query])
-        
-        # Calculate similarities
-        similarities = []
-        for i, pattern_embedding in enumerate(self.pattern_embeddings):
-            # Calculate cosine similarity
-            import numpy as np
-            similarity = np.dot(query_embedding[0], pattern_embedding) / (
-                np.linalg.norm(query_embedding[0]) * np.linalg.norm(pattern_embedding)
-            )
-            similarities.append((similarity, i))
+        """Return the training example if the query is close to the pattern centroid."""
+        if self._fast_re.search(query):
+            logger.info("Query matches training example (action + application name)")
+            return self.example
+        
+        pattern_embeddings = self.pattern_embeddings  # Also computes the centroid
+        query_embedding = self.embedding_model.encode([query], normalize_embeddings=True)[0]
+        score = float(query_embedding @ self._centroid)
         
-        # Get best match
-        similarities.sort(reverse=True, key=lambda x: x[0])
-        best_match_idx = similarities[0][1]
-        best_similarity = similarities[0][0]
+        if self.debug:
+            # Full pattern scan only for provenance logging
+            best_match_idx, best_similarity = best_match(
+                pattern_embeddings.astype(np.float32), query_embedding.astype(np.float32)
+            )
+            logger.debug(f"Closest pattern: {self._pattern_texts[best_match_idx]} (similarity: {best_similarity:.3f})")
         
-        if best_similarity > 0.7:  # Threshold for good match
-            logger.info(f"Found matching pattern: {self.patterns[best_match_idx]['pattern']} (similarity: {best_similarity:.3f})")
-            return self.patterns[best_match_idx]["example"]
+        if score > self.CENTROID_THRESHOLD:
+            logger.info(f"Query matches training example (centroid similarity: {score:.3f})")
+            return self.example
         else:
-            logger.warning(f"No good pattern match found for query: {query} (best similarity: {best_similarity:.3f})")
+            logger.warning(f"No good pattern match found for query: {query} (centroid similarity: {score:.3f})")
             return None
     
     def get_all_patterns(self) -> List[Dict[str, Any]]:
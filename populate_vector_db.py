@@ -4,13 +4,140 @@ Populate Vector DB with Patterns, Table Names, Table Definitions, Prompts, and T
 This script sets up the complete Vector DB for the Two-Step Search system
 """
 
+import hashlib
 import json
 import os
-from typing import Dict, List, Any, Optional
+import shelve
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
 from loguru import logger
 import chromadb
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
-from config import settings
+from sqlalchemy import bindparam, create_engine, text
+from config import COLLECTION_EMBEDDING_MODEL, settings
+
+try:
+    import onnxruntime
+    from transformers import AutoTokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+# (documents, metadatas, ids) for one collection
+DocumentBatch = Tuple[List[str], List[Dict[str, Any]], List[str]]
+
+# Let the encoder use every core for the batch encodes below
+torch.set_num_threads(os.cpu_count() or 1)
+
+# Essential IdentityIQ tables users commonly query: core identity, application,
+# link tables and related entities
+ESSENTIAL_TABLES = (
+    "spt_identity", "spt_application", "spt_link", "spt_identity_entitlement", "spt_identity_request", "spt_identity_request_item", "spt_identity_assigned_roles", "spt_identity_workgroups", "spt_identity_capabilities", "spt_identity_bundles", "spt_identity_controlled_scopes", "spt_identity_external_attr", "spt_identity_history_item", "spt_identity_role_metadata", "spt_identity_snapshot", "spt_identity_trigger",
+    "spt_app_dependencies", "spt_app_secondary_owners", "spt_application_activity", "spt_application_remediators", "spt_application_schema", "spt_application_scorecard",
+    "spt_link_external_attr", "spt_managed_attribute", "spt_managed_attr_inheritance", "spt_managed_attr_perms", "spt_managed_attr_target_perms",
+    "spt_bundle", "spt_bundle_children", "spt_bundle_permits", "spt_bundle_requirements", "spt_capability", "spt_capability_children", "spt_capability_rights",
+    "spt_profile", "spt_profile_constraints", "spt_profile_permissions", "spt_scope", "spt_target", "spt_target_association", "spt_target_source", "spt_target_sources",
+    "spt_right", "spt_right_config", "spt_rule", "spt_rule_dependencies", "spt_rule_registry", "spt_rule_registry_callouts", "spt_rule_signature_arguments", "spt_rule_signature_returns",
+    "spt_policy", "spt_policy_violation", "spt_sodconstraint", "spt_sodconstraint_left", "spt_sodconstraint_right",
+    "spt_certification", "spt_certification_action", "spt_certification_definition", "spt_certification_delegation", "spt_certification_entity", "spt_certification_group", "spt_certification_groups", "spt_certification_item", "spt_certification_tags", "spt_certifiers",
+    "spt_work_item", "spt_work_item_comments", "spt_work_item_config", "spt_work_item_owners", "spt_workflow", "spt_workflow_case", "spt_workflow_registry", "spt_workflow_rule_libraries", "spt_workflow_target",
+    "spt_audit_event", "spt_audit_config", "spt_alert", "spt_alert_action", "spt_alert_definition", "spt_configuration",
+    "spt_account_group", "spt_account_group_inheritance", "spt_account_group_perms", "spt_account_group_target_perms", "spt_entitlement_group", "spt_entitlement_snapshot",
+)
+
+
+def content_sha(document: str, metadata: Dict[str, Any]) -> str:
+    """Short hash of a document and its metadata, stored to detect unchanged entries."""
+    payload = document + json.dumps(metadata, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by a hash of model name and text.
+    
+    Vectors are stored as float16, halving the on-disk size; they are
+    unit-normalized, so the precision loss is far below retrieval noise.
+    """
+    
+    def __init__(self, path: str, model_name: str):
+        """Initialize the cache.
+        
+        Args:
+            path: Shelve file path (its directory is created if missing)
+            model_name: Embedding model name, part of every key so a model change invalidates entries
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.model_name = model_name
+    
+    def _key(self, text: str) -> str:
+        """Content hash for a text under this model."""
+        return hashlib.sha256((self.model_name + text).encode("utf-8")).hexdigest()
+    
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Return the cached vector for each text, or None where it is not cached."""
+        with shelve.open(self.path) as cache:
+            embeddings = [cache.get(self._key(text)) for text in texts]
+        return [None if embedding is None else embedding.astype(np.float32) for embedding in embeddings]
+    
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        """Store vectors for the given texts."""
+        with shelve.open(self.path) as cache:
+            for text, embedding in zip(texts, embeddings):
+                cache[self._key(text)] = np.asarray(embedding, dtype=np.float16)
+
+
+class OnnxEncoder:
+    """CPU encoder over an ONNX export of the sentence transformer.
+    
+    Mirrors the parts of SentenceTransformer the populator uses: ``tokenizer``
+    and ``encode`` returning mean-pooled, L2-normalized numpy vectors. Point
+    it at an (optionally int8-quantized) export, e.g. produced with
+    ``optimum-cli export onnx`` followed by ``optimum-cli onnxruntime quantize``.
+    """
+    
+    MAX_SEQ_LENGTH = 256
+    
+    def __init__(self, model_dir: str):
+        """Load the model and tokenizer.
+        
+        Args:
+            model_dir: Directory holding model.onnx (or model_quantized.onnx) and the tokenizer files
+        """
+        model_file = os.path.join(model_dir, "model_quantized.onnx")
+        if not os.path.exists(model_file):
+            model_file = os.path.join(model_dir, "model.onnx")
+        
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    
+    def encode(self, sentences: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        """Encode sentences into normalized float32 vectors."""
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.MAX_SEQ_LENGTH,
+                return_tensors="np"
+            )
+            feed = {name: inputs[name].astype(np.int64) for name in self.input_names if name in inputs}
+            token_embeddings = self.session.run(None, feed)[0]
+            
+            # Mean pooling over real tokens, then L2 normalization
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            batches.append(pooled / np.linalg.norm(pooled, axis=1, keepdims=True).clip(1e-12))
+        
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(batches).astype(np.float32)
 
 
 class VectorDBPopulator:
@@ -19,145 +146,212 @@ class VectorDBPopulator:
     def __init__(self):
         """Initialize the Vector DB populator."""
         self.vector_db_client = chromadb.PersistentClient(path="./chromadb")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model_name = COLLECTION_EMBEDDING_MODEL
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        onnx_model_path = settings.vector_db.onnx_model_path
+        if self.device == "cpu" and onnx_model_path and ONNX_AVAILABLE:
+            self.embedding_model = OnnxEncoder(onnx_model_path)
+            self.device = "cpu (onnxruntime)"
+        else:
+            if onnx_model_path and self.device == "cpu":
+                logger.warning("onnxruntime/transformers not installed, using SentenceTransformer")
+            self.embedding_model = SentenceTransformer(self.model_name, device=self.device)
+            if self.device == "cuda":
+                # Half precision halves GPU memory and runs on tensor cores
+                self.embedding_model.half()
+        logger.info(f"Encoding on {self.device}")
+        # Keep ONNX vectors apart from SentenceTransformer ones; a quantized export drifts slightly
+        cache_model_name = f"{self.model_name}:onnx" if isinstance(self.embedding_model, OnnxEncoder) else self.model_name
+        self.embedding_cache = EmbeddingCache("./embedding_cache/embeddings", cache_model_name)
+        self._relevant_table_names: Optional[List[str]] = None
+        
+        # One pooled engine for all database reads; sized for the definition fetch workers
+        self.engine = create_engine(settings.db.connection_string, pool_size=8, pool_pre_ping=True)
+        
+        # HNSW index parameters; Chroma only honours these when a collection is created
+        self.collection_metadata = {
+            "hnsw:space": settings.vector_db.hnsw_space,
+            "hnsw:M": settings.vector_db.hnsw_m,
+            "hnsw:construction_ef": settings.vector_db.hnsw_construction_ef,
+            "hnsw:search_ef": settings.vector_db.hnsw_search_ef,
+        }
         self._initialize_collections()
         
     def _initialize_collections(self):
         """Initialize all Vector DB collections."""
         self.collections = {}
+        existing = {collection.name for collection in self.vector_db_client.list_collections()}
         
-        # Collection 1: Pattern → Table Names mapping
-        try:
-            self.collections['pattern_to_tables'] = self.vector_db_client.get_collection("pattern_to_tables")
-            logger.info("Using existing pattern_to_tables collection")
-        except:
-            logger.info("Creating new pattern_to_tables collection")
-            self.collections['pattern_to_tables'] = self.vector_db_client.create_collection("pattern_to_tables")
+        # Pattern → Table Names mapping, Table Names → Table Definitions,
+        # Prompt Templates and Training Examples
+        for name in ["pattern_to_tables", "table_definitions", "prompt_templates", "training_examples"]:
+            if name in existing:
+                logger.info(f"Using existing {name} collection")
+                self.collections[name] = self.vector_db_client.get_collection(name)
+            else:
+                logger.info(f"Creating new {name} collection")
+                self.collections[name] = self.vector_db_client.create_collection(name, metadata=self.collection_metadata)
         
-        # Collection 2: Table Names → Table Definitions
-        try:
-            self.collections['table_definitions'] = self.vector_db_client.get_collection("table_definitions")
-            logger.info("Using existing table_definitions collection")
-        except:
-            logger.info("Creating new table_definitions collection")
-            self.collections['table_definitions'] = self.vector_db_client.create_collection("table_definitions")
+        logger.info("All Vector DB collections initialized successfully")
+    
+    def _encode(self, documents: List[str]) -> List[List[float]]:
+        """Batch-encode documents for Chroma instead of letting it embed them one call at a time.
         
-        # Collection 3: Prompt Templates
-        try:
-            self.collections['prompt_templates'] = self.vector_db_client.get_collection("prompt_templates")
-            logger.info("Using existing prompt_templates collection")
-        except:
-            logger.info("Creating new prompt_templates collection")
-            self.collections['prompt_templates'] = self.vector_db_client.create_collection("prompt_templates")
+        Vectors already in the on-disk embedding cache are reused; only the
+        rest go through the encoder. Vectors are normalized to match Chroma's
+        default all-MiniLM-L6-v2 embedding function, which the query side
+        still uses via query_texts.
+        """
+        embeddings = self.embedding_cache.get_many(documents)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
         
-        # Collection 4: Training Examples
-        try:
-            self.collections['training_examples'] = self.vector_db_client.get_collection("training_examples")
-            logger.info("Using existing training_examples collection")
-        except:
-            logger.info("Creating new training_examples collection")
-            self.collections['training_examples'] = self.vector_db_client.create_collection("training_examples")
+        if missing:
+            missing_documents = [documents[i] for i in missing]
+            encoded = self._encode_uncached(missing_documents)
+            self.embedding_cache.put_many(missing_documents, encoded)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
         
-        logger.info("All Vector DB collections initialized successfully")
+        logger.info(f"Encoded {len(missing)} documents ({len(documents) - len(missing)} from cache)")
+        return np.stack(embeddings).tolist()
+    
+    def _encode_uncached(self, documents: List[str]) -> np.ndarray:
+        """Encode documents in order of token length, returned in input order.
+        
+        Sorting means each batch pads to a similar length, which matters for
+        the widely varying CREATE TABLE statements.
+        """
+        tokenizer = self.embedding_model.tokenizer
+        lengths = [len(tokenizer.tokenize(document)) for document in documents]
+        order = np.argsort(lengths, kind="stable")
+        
+        sorted_embeddings = self.embedding_model.encode(
+            [documents[i] for i in order],
+            batch_size=32,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+    
+    def _add_documents(self, collection_name: str, documents: List[str], metadatas: List[Dict[str, Any]],
+                       ids: List[str], embeddings: Optional[List[List[float]]] = None):
+        """Add a batch of documents to a collection, encoding them unless embeddings are given."""
+        if not documents:
+            return
+        
+        self.collections[collection_name].add(
+            documents=documents,
+            embeddings=embeddings if embeddings is not None else self._encode(documents),
+            metadatas=[
+                {**metadata, "content_sha": content_sha(document, metadata)}
+                for document, metadata in zip(documents, metadatas)
+            ],
+            ids=ids
+        )
+    
+    def _gather_pattern_to_tables(self) -> DocumentBatch:
+        """Build pattern to table names mapping documents."""
+        # Import patterns from iiq_prompt_templates.py (shared module instance)
+        from iiq_prompt_templates import iiq_prompt_templates as prompt_templates
+        
+        # Identical pattern texts are stored once; every pattern id sharing
+        # the text is recorded in that document's "pattern_ids" metadata
+        pattern_ids: Dict[str, List[str]] = {}
+        for i, pattern in enumerate(prompt_templates.patterns):
+            pattern_ids.setdefault(pattern["pattern"], []).append(f"pattern_{i}")
+        
+        documents = list(pattern_ids)
+        metadatas = [{
+            "table_names": "spt_identity,spt_application,spt_link",  # All 260 patterns map to these 3 tables
+            "pattern_type": "user_application_access",
+            "pattern_ids": ",".join(pattern_ids[document])
+        } for document in documents]
+        ids = [pattern_ids[document][0] for document in documents]
+        
+        if len(documents) < len(prompt_templates.patterns):
+            logger.info(f"Deduplicated {len(prompt_templates.patterns)} patterns to {len(documents)} unique texts")
+        return documents, metadatas, ids
     
     def populate_pattern_to_tables(self):
         """Populate pattern to table names mapping."""
         logger.info("Populating pattern_to_tables collection...")
         
-        # Import patterns from iiq_prompt_templates.py
-        from iiq_prompt_templates import IIQPromptTemplates
-        prompt_templates = IIQPromptTemplates()
-        
-        # Create pattern to table mapping
-        pattern_to_tables_data = []
-        
-        for pattern in prompt_templates.patterns:
-            pattern_to_tables_data.append({
-                "pattern": pattern["pattern"],
-                "table_names": "spt_identity,spt_application,spt_link",  # All 260 patterns map to these 3 tables
-                "pattern_type": "user_application_access"
-            })
-        
-        # Add to Vector DB
-        for i, data in enumerate(pattern_to_tables_data):
-            self.collections['pattern_to_tables'].add(
-                documents=[data["pattern"]],
-                metadatas=[{
-                    "table_names": data["table_names"],
-                    "pattern_type": data["pattern_type"]
-                }],
-                ids=[f"pattern_{i}"]
-            )
+        # Add to Vector DB in a single batch
+        documents, metadatas, ids = self._gather_pattern_to_tables()
+        self._add_documents('pattern_to_tables', documents, metadatas, ids)
         
-        logger.info(f"Added {len(pattern_to_tables_data)} pattern-to-tables mappings")
+        logger.info(f"Added {len(documents)} pattern-to-tables mappings")
     
-    def populate_table_definitions(self):
-        """Populate table definitions from database."""
-        logger.info("Populating table_definitions collection...")
-        
+    def _gather_table_definitions(self) -> DocumentBatch:
+        """Fetch table definition documents from the database."""
         try:
-            from sqlalchemy import create_engine, text
-            engine = create_engine(settings.db.connection_string)
-            
             # Get table names dynamically from iiq_prompt_templates.py patterns
             # All 260 patterns map to these 3 tables, but in future this can be expanded
             table_names = self._get_relevant_table_names()
             
-            for table_name in table_names:
-                # Get CREATE TABLE statement from database
-                query = f"SHOW CREATE TABLE identityiq.{table_name}"
-                with engine.connect() as connection:
-                    result = connection.execute(text(query))
-                    row = result.fetchone()
-                    create_statement = row[1] if row else ""
-                
+            # Fetch CREATE TABLE statements concurrently, each worker on its own pooled connection
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(self._fetch_create_statement, table_names))
+            
+            documents = []
+            added_tables = []
+            for table_name, create_statement in results:
                 if create_statement:
-                    # Add to Vector DB
-                    self.collections['table_definitions'].add(
-                        documents=[create_statement],
-                        metadatas=[{"table_name": table_name}],
-                        ids=[table_name]
-                    )
-                    logger.info(f"Added definition for table: {table_name}")
+                    documents.append(create_statement)
+                    added_tables.append(table_name)
                 else:
                     logger.warning(f"No CREATE TABLE statement found for: {table_name}")
+            
+            # Formatted only if a sink accepts INFO
+            logger.opt(lazy=True).info(
+                "Added definitions for {n} tables: {names}",
+                n=lambda: len(added_tables), names=lambda: ", ".join(added_tables)
+            )
+            
+            return documents, [{"table_name": table_name} for table_name in added_tables], added_tables
         
         except Exception as e:
             logger.error(f"Error fetching table definitions from database: {e}")
             logger.error("Cannot proceed without table definitions from database!")
             raise e
     
+    def _fetch_create_statement(self, table_name: str) -> Tuple[str, str]:
+        """Get the CREATE TABLE statement for one table from the database."""
+        query = f"SHOW CREATE TABLE identityiq.{table_name}"
+        with self.engine.connect() as connection:
+            row = connection.execute(text(query)).fetchone()
+        return table_name, row[1] if row else ""
+    
+    def populate_table_definitions(self):
+        """Populate table definitions from database."""
+        logger.info("Populating table_definitions collection...")
+        
+        # Add to Vector DB in a single batch
+        self._add_documents('table_definitions', *self._gather_table_definitions())
+    
     def _get_relevant_table_names(self) -> List[str]:
         """Get ONLY the essential IdentityIQ table names that users commonly query."""
+        if self._relevant_table_names is not None:
+            return self._relevant_table_names
+        
         try:
-            from sqlalchemy import create_engine, text
-            engine = create_engine(settings.db.connection_string)
-            
-            # Get ONLY the essential IdentityIQ tables that users commonly query
-            # This includes core identity, application, link tables and related entities
-            query = """
+            query = text("""
             SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_SCHEMA = 'identityiq' 
-            AND (
-                TABLE_NAME IN ('spt_identity', 'spt_application', 'spt_link', 'spt_identity_entitlement', 'spt_identity_request', 'spt_identity_request_item', 'spt_identity_assigned_roles', 'spt_identity_workgroups', 'spt_identity_capabilities', 'spt_identity_bundles', 'spt_identity_controlled_scopes', 'spt_identity_external_attr', 'spt_identity_history_item', 'spt_identity_role_metadata', 'spt_identity_snapshot', 'spt_identity_trigger')
-                OR TABLE_NAME IN ('spt_app_dependencies', 'spt_app_secondary_owners', 'spt_application_activity', 'spt_application_remediators', 'spt_application_schema', 'spt_application_scorecard')
-                OR TABLE_NAME IN ('spt_link_external_attr', 'spt_managed_attribute', 'spt_managed_attr_inheritance', 'spt_managed_attr_perms', 'spt_managed_attr_target_perms')
-                OR TABLE_NAME IN ('spt_bundle', 'spt_bundle_children', 'spt_bundle_permits', 'spt_bundle_requirements', 'spt_capability', 'spt_capability_children', 'spt_capability_rights')
-                OR TABLE_NAME IN ('spt_profile', 'spt_profile_constraints', 'spt_profile_permissions', 'spt_scope', 'spt_target', 'spt_target_association', 'spt_target_source', 'spt_target_sources')
-                OR TABLE_NAME IN ('spt_right', 'spt_right_config', 'spt_rule', 'spt_rule_dependencies', 'spt_rule_registry', 'spt_rule_registry_callouts', 'spt_rule_signature_arguments', 'spt_rule_signature_returns')
-                OR TABLE_NAME IN ('spt_policy', 'spt_policy_violation', 'spt_sodconstraint', 'spt_sodconstraint_left', 'spt_sodconstraint_right')
-                OR TABLE_NAME IN ('spt_certification', 'spt_certification_action', 'spt_certification_definition', 'spt_certification_delegation', 'spt_certification_entity', 'spt_certification_group', 'spt_certification_groups', 'spt_certification_item', 'spt_certification_tags', 'spt_certifiers')
-                OR TABLE_NAME IN ('spt_work_item', 'spt_work_item_comments', 'spt_work_item_config', 'spt_work_item_owners', 'spt_workflow', 'spt_workflow_case', 'spt_workflow_registry', 'spt_workflow_rule_libraries', 'spt_workflow_target')
-                OR TABLE_NAME IN ('spt_audit_event', 'spt_audit_config', 'spt_alert', 'spt_alert_action', 'spt_alert_definition', 'spt_configuration')
-                OR TABLE_NAME IN ('spt_account_group', 'spt_account_group_inheritance', 'spt_account_group_perms', 'spt_account_group_target_perms', 'spt_entitlement_group', 'spt_entitlement_snapshot')
-            )
+            WHERE TABLE_SCHEMA = 'identityiq' AND TABLE_NAME IN :names
             ORDER BY TABLE_NAME
-            """
-            with engine.connect() as connection:
-                result = connection.execute(text(query))
+            """).bindparams(bindparam("names", expanding=True))
+            with self.engine.connect() as connection:
+                result = connection.execute(query, {"names": ESSENTIAL_TABLES})
                 table_names = [row[0] for row in result]
             
-            logger.info(f"Found {len(table_names)} essential IdentityIQ tables for user queries: {table_names}")
+            logger.opt(lazy=True).info(
+                "Found {n} essential IdentityIQ tables for user queries: {names}",
+                n=lambda: len(table_names), names=lambda: table_names
+            )
+            self._relevant_table_names = table_names
             return table_names
             
         except Exception as e:
@@ -167,36 +361,37 @@ class VectorDBPopulator:
             return ["spt_identity", "spt_application", "spt_link"]
     
     
+    def _gather_prompt_templates(self) -> DocumentBatch:
+        """Build prompt template documents."""
+        # Import prompt from iiq_prompt_templates.py (shared module instance)
+        from iiq_prompt_templates import iiq_prompt_templates as prompt_templates
+        
+        # The MySQL expert prompt
+        return (
+            [prompt_templates.prompt_template],
+            [{"prompt_type": "mysql_expert", "description": "MySQL expert prompt for IdentityIQ queries"}],
+            ["mysql_expert_prompt"]
+        )
+    
     def populate_prompt_templates(self):
         """Populate prompt templates."""
         logger.info("Populating prompt_templates collection...")
         
-        # Import prompt from iiq_prompt_templates.py
-        from iiq_prompt_templates import IIQPromptTemplates
-        prompt_templates = IIQPromptTemplates()
-        
-        # Add the MySQL expert prompt
-        self.collections['prompt_templates'].add(
-            documents=[prompt_templates.prompt_template],
-            metadatas=[{"prompt_type": "mysql_expert", "description": "MySQL expert prompt for IdentityIQ queries"}],
-            ids=["mysql_expert_prompt"]
-        )
+        self._add_documents('prompt_templates', *self._gather_prompt_templates())
         
         logger.info("Added MySQL expert prompt template")
     
-    def populate_training_examples(self):
-        """Populate training examples."""
-        logger.info("Populating training_examples collection...")
-        
+    def _gather_training_examples(self) -> DocumentBatch:
+        """Build training example documents."""
         # Import training example from iiq_training_examples.py
         from iiq_training_examples import IIQTrainingExamples
         training_examples = IIQTrainingExamples()
         
-        # Add the training example
+        # The training example
         example = training_examples.example
-        self.collections['training_examples'].add(
-            documents=[example["natural_language"]],
-            metadatas=[{
+        return (
+            [example["natural_language"]],
+            [{
                 "sql_query": example["sql_query"],
                 "explanation": example["explanation"],
                 "query_type": example["query_type"],
@@ -204,24 +399,83 @@ class VectorDBPopulator:
                 "key_concepts": ",".join(example["key_concepts"]),
                 "difficulty": example["difficulty"]
             }],
-            ids=["training_example_1"]
+            ["training_example_1"]
         )
+    
+    def populate_training_examples(self):
+        """Populate training examples."""
+        logger.info("Populating training_examples collection...")
+        
+        self._add_documents('training_examples', *self._gather_training_examples())
         
         logger.info("Added training example")
     
+    def _gather_all_docs(self) -> Dict[str, DocumentBatch]:
+        """Gather the (documents, metadatas, ids) of every collection."""
+        return {
+            'pattern_to_tables': self._gather_pattern_to_tables(),
+            'table_definitions': self._gather_table_definitions(),
+            'prompt_templates': self._gather_prompt_templates(),
+            'training_examples': self._gather_training_examples(),
+        }
+    
+    def _pending_changes(self, collection_name: str, batch: DocumentBatch) -> Tuple[List[str], DocumentBatch]:
+        """Compare a batch with what a collection already holds, by content hash.
+        
+        Returns:
+            Ids to delete (removed or changed since the last run) and the part
+            of the batch that still has to be added
+        """
+        existing = self.collections[collection_name].get(include=["metadatas"])
+        existing_shas = {
+            id_: (metadata or {}).get("content_sha")
+            for id_, metadata in zip(existing["ids"], existing["metadatas"])
+        }
+        
+        documents, metadatas, ids = batch
+        shas = dict(zip(ids, (content_sha(document, metadata) for document, metadata in zip(documents, metadatas))))
+        
+        stale_ids = [id_ for id_, sha in existing_shas.items() if shas.get(id_) != sha]
+        changed = [i for i, id_ in enumerate(ids) if existing_shas.get(id_) != shas[id_]]
+        return stale_ids, (
+            [documents[i] for i in changed],
+            [metadatas[i] for i in changed],
+            [ids[i] for i in changed]
+        )
+    
     def populate_all_collections(self):
-        """Populate all Vector DB collections."""
+        """Populate all Vector DB collections.
+        
+        Only documents whose content hash is not already stored are encoded
+        and added, so rerunning against an unchanged source is cheap.
+        """
         logger.info("Starting complete Vector DB population...")
         
         try:
-            # Clear existing collections
-            self._clear_collections()
+            # Recreate collections whose index parameters changed
+            self._clear_collections(only_outdated=True)
             
-            # Populate all collections
-            self.populate_pattern_to_tables()
-            self.populate_table_definitions()
-            self.populate_prompt_templates()
-            self.populate_training_examples()
+            pending = {}
+            for collection_name, batch in self._gather_all_docs().items():
+                stale_ids, delta = self._pending_changes(collection_name, batch)
+                if stale_ids:
+                    self.collections[collection_name].delete(ids=stale_ids)
+                if delta[0]:
+                    pending[collection_name] = delta
+                else:
+                    logger.info(f"{collection_name} is up to date, skipping")
+            
+            # Encode the new documents of all collections in one pass, then add each slice
+            if pending:
+                embeddings = self._encode([document for documents, _, _ in pending.values() for document in documents])
+                
+                start = 0
+                for collection_name, (documents, metadatas, ids) in pending.items():
+                    end = start + len(documents)
+                    logger.info(f"Populating {collection_name} collection...")
+                    self._add_documents(collection_name, documents, metadatas, ids, embeddings=embeddings[start:end])
+                    logger.info(f"Added {end - start} documents to {collection_name}")
+                    start = end
             
             logger.success("Vector DB population completed successfully!")
             
@@ -231,15 +485,32 @@ class VectorDBPopulator:
         except Exception as e:
             logger.error(f"Error during Vector DB population: {e}")
     
-    def _clear_collections(self):
-        """Clear all existing collections."""
+    def _clear_collections(self, only_outdated: bool = False):
+        """Clear all existing collections.
+        
+        Collections are emptied in place; one is only dropped and recreated
+        when its index parameters differ from the configured ones, since
+        those can only be set at creation.
+        
+        Args:
+            only_outdated: Only recreate collections with outdated index parameters, leave the rest as they are
+        """
         logger.info("Clearing existing collections...")
         
         for collection_name, collection in self.collections.items():
             try:
-                # Delete and recreate collection
-                self.vector_db_client.delete_collection(collection_name)
-                self.collections[collection_name] = self.vector_db_client.create_collection(collection_name)
+                if collection.metadata == self.collection_metadata and only_outdated:
+                    continue
+                if collection.metadata != self.collection_metadata:
+                    # Delete and recreate collection to apply the HNSW parameters
+                    self.vector_db_client.delete_collection(collection_name)
+                    self.collections[collection_name] = self.vector_db_client.create_collection(
+                        collection_name, metadata=self.collection_metadata
+                    )
+                else:
+                    ids = collection.get(include=[])["ids"]
+                    if ids:
+                        collection.delete(ids=ids)
                 logger.info(f"Cleared collection: {collection_name}")
             except Exception as e:
                 logger.warning(f"Could not clear collection {collection_name}: {e}")
@@ -5,13 +5,20 @@ Developed by: Kuldeep Singh Rautela
 Contact: rautela.ks.job@gmail.com for commercial licensing
 """
 
-from typing import List, Dict, Any, Optional, Set
+import copy
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
+from typing import List, Dict, Any, Optional, Set, Tuple
 import chromadb
+import numpy as np
+import torch
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 # Training embedder no longer needed - using new Vector DB approach
 from loguru import logger
-from config import settings
+from config import COLLECTION_EMBEDDING_MODEL, settings
 # Basic synonyms mapping for query preprocessing
 SYNONYMS = {
     "users": "spt_identity",
@@ -30,13 +37,64 @@ SYNONYMS = {
     "systems": "spt_application"
 }
 
+# All synonym terms in one alternation, longest first so "user accounts" wins over "user".
+# Terms only match whole words, so "user" is left alone inside "username".
+SYNONYMS_RE = re.compile(
+    r"\b(?:" + "|".join(re.escape(term) for term in sorted(SYNONYMS, key=len, reverse=True)) + r")\b"
+)
+
+# Joins queries for batch synonym replacement
+QUERY_SEPARATOR = "\x1e"
+
+# Query texts whose embeddings are kept per retriever
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# Retrieval results reused for enhanced queries at least this similar
+RESULT_CACHE_THRESHOLD = 0.98
+RESULT_CACHE_SIZE = 256
+
+# Sort key for chunks, columns and relationships
+BY_SIMILARITY = itemgetter("similarity_score")
+
+# Core tables added to the schema context whenever the enhanced query names them
+CORE_TABLES = ("spt_identity", "spt_link", "spt_application")
+
+# Runs the training-example query while the schema query is in flight
+QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="retriever")
+
+
+def split_query_results(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Split a multi-embedding Chroma query result into one result per embedding."""
+    return [
+        {key: [value[i]] if isinstance(value, list) else value for key, value in results.items()}
+        for i in range(len(results["ids"]))
+    ]
+
 
 class SchemaRetriever:
     """Retrieve relevant schema information based on natural language queries."""
     
     def __init__(self):
         """Initialize schema retriever with ChromaDB connection."""
-        self.embedding_model = SentenceTransformer(settings.vector_db.embedding_model)
+        if torch.cuda.is_available():
+            self.device = "cuda"
+        elif getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+            self.device = "mps"
+        else:
+            self.device = "cpu"
+        # Queries must be embedded in the same space as the stored chunks
+        self.embedding_model = SentenceTransformer(COLLECTION_EMBEDDING_MODEL, device=self.device)
+        if self.device != "cpu":
+            # Half precision halves memory traffic of the forward pass on GPU
+            self.embedding_model.half()
+        self.embedding_model.eval()
+        # Pay CUDA/MPS kernel setup now rather than on the first request
+        self._encode_query("warmup")
+        logger.info(f"RETRIEVER: Query encoder on {self.device}")
+        # Repeated questions reuse their embedding instead of a new forward pass
+        self._embed = lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._encode_query)
+        # retrieve_relevant_schema results, one semantic cache per (top_k, include_relationships, filter_types)
+        self._result_caches: Dict[Tuple, Any] = {}
         
         # Initialize ChromaDB
         self.chroma_client = chromadb.PersistentClient(
@@ -58,19 +116,47 @@ class SchemaRetriever:
         except Exception as e:
             logger.error(f"Failed to connect to collections: {e}")
             raise RuntimeError(f"Collections not found. Please run schema and training embedding first.")
+        
+        for collection in (self.schema_collection, self.training_collection):
+            self._check_embedding_dimension(collection)
+    
+    def _check_embedding_dimension(self, collection):
+        """Fail fast if stored embeddings do not match the query encoder's dimension."""
+        stored = collection.get(limit=1, include=["embeddings"]).get("embeddings")
+        if not stored:
+            return
+        expected = self.embedding_model.get_sentence_embedding_dimension()
+        if len(stored[0]) != expected:
+            raise RuntimeError(
+                f"Collection {collection.name} holds {len(stored[0])}-dimensional embeddings but "
+                f"{COLLECTION_EMBEDDING_MODEL} produces {expected}; re-run the embedding scripts"
+            )
+    
+    def _encode_query(self, text: str) -> List[float]:
+        """Embed query text for a collection query; called through the _embed cache."""
+        with torch.inference_mode():
+            embedding = self.embedding_model.encode([text], convert_to_numpy=True, normalize_embeddings=True)[0]
+        return embedding.astype(np.float32).tolist()
     
     def _preprocess_query_with_synonyms(self, query: str) -> str:
-        """Preprocess query by replacing synonyms with database terms."""
-        enhanced_query = query.lower()
+        """Preprocess query by replacing synonyms with database terms.
         
-        # Apply synonym mappings
-        for human_term, db_term in SYNONYMS.items():
-            if human_term.lower() in enhanced_query:
-                enhanced_query = enhanced_query.replace(human_term.lower(), db_term)
-                logger.info(f"RETRIEVER: Replaced '{human_term}' with '{db_term}'")
+        The returned query is lower case, so callers need not lower it again.
+        """
+        # Apply synonym mappings in a single pass over the query
+        replaced = {}
+        
+        def substitute(match: re.Match) -> str:
+            replaced[match.group()] = SYNONYMS[match.group()]
+            return SYNONYMS[match.group()]
+        
+        query_lower = query.lower()
+        enhanced_query = SYNONYMS_RE.sub(substitute, query_lower)
+        for human_term, db_term in replaced.items():
+            logger.info(f"RETRIEVER: Replaced '{human_term}' with '{db_term}'")
         
         # If synonyms were applied, log the enhancement
-        if enhanced_query != query.lower():
+        if replaced:
             logger.info(f"RETRIEVER: Original query: '{query}'")
             logger.info(f"RETRIEVER: Enhanced query: '{enhanced_query}'")
         else:
@@ -78,6 +164,19 @@ class SchemaRetriever:
         
         return enhanced_query
     
+    def preprocess_queries_with_synonyms(self, queries: List[str]) -> List[str]:
+        """Replace synonyms in many queries with one regex pass over all of them.
+        
+        The queries are joined with a record separator, which no synonym
+        contains and which counts as a word boundary, so matches never
+        span two queries.
+        """
+        if len(queries) <= 1:
+            return [self._preprocess_query_with_synonyms(query) for query in queries]
+        
+        blob = QUERY_SEPARATOR.join(queries).lower()
+        return SYNONYMS_RE.sub(lambda match: SYNONYMS[match.group()], blob).split(QUERY_SEPARATOR)
+    
     def retrieve_relevant_schema(
         self, 
         query: str, 
@@ -118,22 +217,54 @@ class SchemaRetriever:
             else:
                 logger.info(f"RETRIEVER: No filters applied")
             
-            logger.info(f"RETRIEVER: Querying schema collection")
-            # Query the schema collection with enhanced query
-            schema_results = self.schema_collection.query(
-                query_texts=[enhanced_query],
-                n_results=top_k,
-                where=where_clause
-            )
+            query_embedding = self._embed(enhanced_query)
+            
+            # Near-identical queries get the same result until clear_result_cache() is called
+            result_cache = None
+            if settings.vector_db.result_cache_enabled:
+                result_cache = self._get_result_cache(top_k, include_relationships, filter_types)
+                query_vector = np.asarray(query_embedding, dtype=np.float32)
+                cached = result_cache.get(enhanced_query, query_vector)
+                if cached is not None:
+                    cached_result, similarity = cached
+                    logger.info(f"RETRIEVER: Reusing cached retrieval for '{cached_result['enhanced_query']}' (similarity {similarity:.3f})")
+                    result = copy.deepcopy(cached_result)
+                    result["query"] = query
+                    result["enhanced_query"] = enhanced_query
+                    return result
             
             logger.info(f"RETRIEVER: Querying training examples collection")
-            # Query the training examples collection with enhanced query
-            training_results = self.training_collection.query(
-                query_texts=[enhanced_query],
+            # Query the training examples collection with enhanced query, alongside the schema query
+            training_future = QUERY_EXECUTOR.submit(
+                self.training_collection.query,
+                query_embeddings=[query_embedding],
                 n_results=3,  # Get top 3 most relevant training examples
                 where=None  # No filters for training examples
             )
             
+            # enhanced_query is already lower case from synonym preprocessing
+            core_tables_mentioned = [table for table in CORE_TABLES if table in enhanced_query]
+            core_table_results = {}
+            
+            logger.info(f"RETRIEVER: Querying schema collection")
+            if where_clause is None and core_tables_mentioned:
+                # Search for the mentioned core tables in the same call as the enhanced query
+                batch_results = split_query_results(self.schema_collection.query(
+                    query_embeddings=[query_embedding] + [self._embed(table) for table in core_tables_mentioned],
+                    n_results=top_k
+                ))
+                schema_results = batch_results[0]
+                core_table_results = dict(zip(core_tables_mentioned, batch_results[1:]))
+            else:
+                # Query the schema collection with enhanced query
+                schema_results = self.schema_collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=top_k,
+                    where=where_clause
+                )
+            
+            training_results = training_future.result()
+            
             # Combine results
             results = schema_results
             
@@ -169,13 +300,17 @@ class SchemaRetriever:
             retrieved_chunks = []
             training_examples = []
             
+            # Convert distances to similarities for all chunks at once
+            schema_similarities = (1.0 - np.asarray(schema_distances, dtype=np.float64)).tolist()
+            training_similarities = (1.0 - np.asarray(training_distances, dtype=np.float64)).tolist()
+            
             # Process schema chunks
-            for i, (doc, meta, distance, chunk_id) in enumerate(zip(schema_documents, schema_metadatas, schema_distances, schema_ids)):
+            for i, (doc, meta, similarity, chunk_id) in enumerate(zip(schema_documents, schema_metadatas, schema_similarities, schema_ids)):
                 chunk_info = {
                     "id": chunk_id,
                     "content": doc,
                     "metadata": meta,
-                    "similarity_score": 1 - distance,  # Convert distance to similarity
+                    "similarity_score": similarity,
                     "rank": i + 1,
                     "source": "schema"
                 }
@@ -236,15 +371,15 @@ class SchemaRetriever:
             
             # Sort columns by similarity score
             for table_info in tables.values():
-                table_info["columns"].sort(key=lambda x: x["similarity_score"], reverse=True)
+                table_info["columns"].sort(key=BY_SIMILARITY, reverse=True)
             
             # Process training examples
-            for i, (doc, meta, distance, chunk_id) in enumerate(zip(training_documents, training_metadatas, training_distances, training_ids)):
+            for i, (doc, meta, similarity, chunk_id) in enumerate(zip(training_documents, training_metadatas, training_similarities, training_ids)):
                 training_info = {
                     "id": chunk_id,
                     "content": doc,
                     "metadata": meta,
-                    "similarity_score": 1 - distance,
+                    "similarity_score": similarity,
                     "rank": i + 1,
                     "source": "training"
                 }
@@ -252,10 +387,10 @@ class SchemaRetriever:
                 logger.info(f"RETRIEVER: Processing training example {i+1}/{len(training_documents)} - Score: {training_info['similarity_score']:.3f}")
             
             # Sort relationships by similarity score
-            relationships.sort(key=lambda x: x["similarity_score"], reverse=True)
+            relationships.sort(key=BY_SIMILARITY, reverse=True)
             
             # Sort training examples by similarity score
-            training_examples.sort(key=lambda x: x["similarity_score"], reverse=True)
+            training_examples.sort(key=BY_SIMILARITY, reverse=True)
             
             # Generate schema context for LLM
             schema_context = self._build_schema_context(tables, relationships, retrieved_chunks)
@@ -264,41 +399,39 @@ class SchemaRetriever:
             training_context = self._build_training_context(training_examples)
             
             # Hybrid approach: Add core tables if they're mentioned in the enhanced query
-            core_tables_to_check = ["spt_identity", "spt_link", "spt_application"]
-            enhanced_query_lower = enhanced_query.lower()
-            
-            for core_table in core_tables_to_check:
-                if core_table in enhanced_query_lower:
-                    full_table_name = f"identityiq.{core_table}"
-                    if full_table_name not in tables:
-                        logger.info(f"RETRIEVER: Adding core table {core_table} based on enhanced query match")
-                        # Try to find the table chunk in ChromaDB
-                        try:
+            for core_table in core_tables_mentioned:
+                full_table_name = f"identityiq.{core_table}"
+                if full_table_name not in tables:
+                    logger.info(f"RETRIEVER: Adding core table {core_table} based on enhanced query match")
+                    # Try to find the table chunk in ChromaDB
+                    try:
+                        table_results = core_table_results.get(core_table)
+                        if table_results is None:
                             # Simple query without complex where clause
                             table_results = self.schema_collection.query(
-                                query_texts=[core_table],
+                                query_embeddings=[self._embed(core_table)],
                                 n_results=5
                             )
+                        
+                        if table_results['documents'] and len(table_results['documents'][0]) > 0:
+                            table_doc = table_results['documents'][0][0]
+                            table_meta = table_results['metadatas'][0][0]
+                            table_distance = table_results['distances'][0][0]
+                            table_similarity = 1 - table_distance
                             
-                            if table_results['documents'] and len(table_results['documents'][0]) > 0:
-                                table_doc = table_results['documents'][0][0]
-                                table_meta = table_results['metadatas'][0][0]
-                                table_distance = table_results['distances'][0][0]
-                                table_similarity = 1 - table_distance
-                                
-                                tables[full_table_name] = {
-                                    "schema": "identityiq",
-                                    "table": core_table,
-                                    "full_name": full_table_name,
-                                    "table_info": table_doc,
-                                    "columns": [],
-                                    "similarity_score": table_similarity
-                                }
-                                logger.info(f"RETRIEVER: Found and added {core_table} table (score: {table_similarity:.3f})")
-                            else:
-                                logger.warning(f"RETRIEVER: Core table {core_table} not found in ChromaDB")
-                        except Exception as e:
-                            logger.error(f"RETRIEVER: Error searching for core table {core_table}: {e}")
+                            tables[full_table_name] = {
+                                "schema": "identityiq",
+                                "table": core_table,
+                                "full_name": full_table_name,
+                                "table_info": table_doc,
+                                "columns": [],
+                                "similarity_score": table_similarity
+                            }
+                            logger.info(f"RETRIEVER: Found and added {core_table} table (score: {table_similarity:.3f})")
+                        else:
+                            logger.warning(f"RETRIEVER: Core table {core_table} not found in ChromaDB")
+                    except Exception as e:
+                        logger.error(f"RETRIEVER: Error searching for core table {core_table}: {e}")
             
             logger.info(f"RETRIEVER: Final results summary:")
             logger.info(f"   - Tables found: {len(tables)}")
@@ -314,7 +447,7 @@ class SchemaRetriever:
             logger.info(f"   - Training context length: {len(training_context)}")
             logger.info(f"RETRIEVER: Schema and training retrieval completed successfully")
             
-            return {
+            result = {
                 "tables": tables,
                 "relationships": relationships,
                 "query": query,
@@ -325,11 +458,38 @@ class SchemaRetriever:
                 "training_context": training_context,
                 "chunks": retrieved_chunks  # For backward compatibility
             }
+            if result_cache is not None:
+                result_cache.put(enhanced_query, copy.deepcopy(result), query_vector)
+            return result
             
         except Exception as e:
             logger.error(f"Error retrieving schema for query '{query}': {e}")
             return {"tables": {}, "relationships": [], "query": query, "retrieved_chunks": []}
     
+    def _get_result_cache(
+        self,
+        top_k: int,
+        include_relationships: bool,
+        filter_types: Optional[List[str]]
+    ):
+        """Semantic cache of retrieval results for one set of retrieval parameters."""
+        cache_key = (top_k, include_relationships, tuple(filter_types) if filter_types else None)
+        result_cache = self._result_caches.get(cache_key)
+        if result_cache is None:
+            # Imported here so numba and faiss only load once a retrieval needs a cache
+            from semantic_cache import SemanticQueryCache
+            result_cache = self._result_caches[cache_key] = SemanticQueryCache(
+                model_name=COLLECTION_EMBEDDING_MODEL,
+                threshold=RESULT_CACHE_THRESHOLD,
+                max_entries=RESULT_CACHE_SIZE
+            )
+        return result_cache
+    
+    def clear_result_cache(self):
+        """Drop cached retrieval results; call after the schema or training examples are re-embedded."""
+        self._result_caches.clear()
+        logger.info("RETRIEVER: Cleared retrieval result cache")
+    
     def get_tables_by_names(self, table_names: List[str]) -> Dict[str, Any]:
         """Retrieve specific tables by their names."""
         try:
@@ -517,7 +677,7 @@ class SchemaRetriever:
                 "total_chunks": count,
                 "type_distribution": type_counts,
                 "collection_name": settings.vector_db.collection_name,
-                "embedding_model": settings.vector_db.embedding_model
+                "embedding_model": COLLECTION_EMBEDDING_MODEL
             }
             
         except Exception as e:
@@ -532,7 +692,7 @@ class SchemaRetriever:
             
             # Search for relevant examples
             results = training_collection.query(
-                query_texts=[query],
+                query_embeddings=[self._embed(query)],
                 n_results=top_k
             )
             
@@ -7,12 +7,21 @@ Contact: rautela.ks.job@gmail.com for commercial licensing
 
 import json
 import os
-from typing import Dict, List, Any, Optional, Tuple
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 from loguru import logger
-from config import settings as app_settings
+from config import COLLECTION_EMBEDDING_MODEL, settings as app_settings
+
+
+@dataclass(slots=True)
+class SchemaChunk:
+    """One schema document to embed."""
+    id: str
+    document: str
+    metadata: Dict[str, Any]
 
 
 class SchemaEmbedder:
@@ -20,7 +29,8 @@ class SchemaEmbedder:
     
     def __init__(self):
         """Initialize schema embedder with ChromaDB and sentence transformer."""
-        self.embedding_model = SentenceTransformer(app_settings.vector_db.embedding_model)
+        # The retriever embeds queries with the same model
+        self.embedding_model = SentenceTransformer(COLLECTION_EMBEDDING_MODEL)
         
         # Initialize ChromaDB
         self.chroma_client = chromadb.PersistentClient(
@@ -60,32 +70,32 @@ class SchemaEmbedder:
         table_name = table_info.get("name", "")
         full_table_name = f"{schema_name}.{table_name}" if schema_name else table_name
         
-        description = f"Table: {full_table_name}\n"
+        parts = [f"Table: {full_table_name}\n"]
         
         # Add columns information
         columns = table_info.get("columns", [])
         if columns:
-            description += "Columns:\n"
+            parts.append("Columns:\n")
             for col in columns:
                 col_name = col.get("name", "")
                 col_type = col.get("type", "")
                 nullable = "NULL" if col.get("nullable", True) else "NOT NULL"
                 default = col.get("default", "")
                 
-                col_desc = f"  - {col_name} ({col_type}) {nullable}"
+                parts.append(f"  - {col_name} ({col_type}) {nullable}")
                 if default:
-                    col_desc += f" DEFAULT {default}"
-                description += col_desc + "\n"
+                    parts.append(f" DEFAULT {default}")
+                parts.append("\n")
         
         # Add primary keys
         primary_keys = table_info.get("primary_keys", [])
         if primary_keys:
-            description += f"Primary Keys: {', '.join(primary_keys)}\n"
+            parts.append(f"Primary Keys: {', '.join(primary_keys)}\n")
         
         # Add foreign keys
         foreign_keys = table_info.get("foreign_keys", [])
         if foreign_keys:
-            description += "Foreign Keys:\n"
+            parts.append("Foreign Keys:\n")
             for fk in foreign_keys:
                 from_cols = ", ".join(fk.get("constrained_columns", []))
                 to_table = fk.get("referred_table", "")
@@ -95,19 +105,19 @@ class SchemaEmbedder:
                 if to_schema and to_schema != schema_name:
                     to_table = f"{to_schema}.{to_table}"
                 
-                description += f"  - {from_cols} -> {to_table}({to_cols})\n"
+                parts.append(f"  - {from_cols} -> {to_table}({to_cols})\n")
         
         # Add indexes
         indexes = table_info.get("indexes", [])
         if indexes:
-            description += "Indexes:\n"
+            parts.append("Indexes:\n")
             for idx in indexes:
                 idx_name = idx.get("name", "")
                 idx_cols = ", ".join(idx.get("column_names", []))
                 unique = "UNIQUE " if idx.get("unique", False) else ""
-                description += f"  - {unique}INDEX {idx_name} ON ({idx_cols})\n"
+                parts.append(f"  - {unique}INDEX {idx_name} ON ({idx_cols})\n")
         
-        return description
+        return "".join(parts)
     
     def _format_column_description(self, col_info: Dict[str, Any], table_name: str, schema_name: str) -> str:
         """Format column information into a descriptive text."""
@@ -118,16 +128,18 @@ class SchemaEmbedder:
         
         full_table_name = f"{schema_name}.{table_name}" if schema_name else table_name
         
-        description = f"Column: {col_name} in table {full_table_name}\n"
-        description += f"Type: {col_type}\n"
-        description += f"Nullable: {nullable}\n"
+        parts = [
+            f"Column: {col_name} in table {full_table_name}\n",
+            f"Type: {col_type}\n",
+            f"Nullable: {nullable}\n",
+        ]
         
         if default:
-            description += f"Default: {default}\n"
+            parts.append(f"Default: {default}\n")
         
-        return description
+        return "".join(parts)
     
-    def _create_schema_chunks(self, schema_info: Dict[str, Any]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    def _create_schema_chunks(self, schema_info: Dict[str, Any]) -> List[SchemaChunk]:
         """Create text chunks from schema information for embedding."""
         chunks = []
         
@@ -146,7 +158,7 @@ class SchemaEmbedder:
                     "table": table_name,
                     "full_name": f"{schema_name}.{table_name}" if schema_name else table_name
                 }
-                chunks.append((table_id, table_description, table_metadata))
+                chunks.append(SchemaChunk(table_id, table_description, table_metadata))
                 
                 # Create column-level chunks for this table
                 columns = table_info.get("columns", [])
@@ -162,14 +174,16 @@ class SchemaEmbedder:
                         "full_table_name": f"{schema_name}.{table_name}" if schema_name else table_name,
                         "data_type": str(col_info.get("type", ""))
                     }
-                    chunks.append((col_id, col_description, col_metadata))
+                    chunks.append(SchemaChunk(col_id, col_description, col_metadata))
         
         # Create relationship chunks
         relationships = schema_info.get("relationships", [])
         for i, rel in enumerate(relationships):
-            rel_description = f"Foreign Key Relationship:\n"
-            rel_description += f"From: {rel.get('from_table')} ({', '.join(rel.get('from_columns', []))})\n"
-            rel_description += f"To: {rel.get('to_table')} ({', '.join(rel.get('to_columns', []))})\n"
+            rel_description = "".join((
+                "Foreign Key Relationship:\n",
+                f"From: {rel.get('from_table')} ({', '.join(rel.get('from_columns', []))})\n",
+                f"To: {rel.get('to_table')} ({', '.join(rel.get('to_columns', []))})\n",
+            ))
             
             rel_id = f"relationship_{i}"
             rel_metadata = {
@@ -179,7 +193,7 @@ class SchemaEmbedder:
                 "from_columns": ",".join(rel.get("from_columns", [])),
                 "to_columns": ",".join(rel.get("to_columns", []))
             }
-            chunks.append((rel_id, rel_description, rel_metadata))
+            chunks.append(SchemaChunk(rel_id, rel_description, rel_metadata))
         
         return chunks
     
@@ -198,14 +212,9 @@ class SchemaEmbedder:
                 return False
             
             # Prepare data for ChromaDB
-            ids = []
-            documents = []
-            metadatas = []
-            
-            for chunk_id, description, metadata in chunks:
-                ids.append(chunk_id)
-                documents.append(description)
-                metadatas.append(metadata)
+            ids = [chunk.id for chunk in chunks]
+            documents = [chunk.document for chunk in chunks]
+            metadatas = [chunk.metadata for chunk in chunks]
             
             # Add to collection in batches
             batch_size = 100
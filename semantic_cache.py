@@ -0,0 +1,303 @@
+"""Semantic cache for generated SQL, keyed by the meaning of the user query.
+
+NL2MySQL v1.0 - IdentityIQ Natural Language to SQL Generator
+Developed by: Kuldeep Singh Rautela
+Contact: rautela.ks.job@gmail.com for commercial licensing
+"""
+
+import atexit
+import os
+import pickle
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from loguru import logger
+from sentence_transformers import SentenceTransformer
+
+from vector_ops import best_match
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+
+DEFAULT_THRESHOLD = 0.87
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_LSH_BITS = 16
+DEFAULT_SAVE_EVERY = 64
+
+
+class SemanticQueryCache:
+    """Cache values for queries that mean the same thing.
+    
+    Queries are embedded with normalized sentence-transformer vectors kept in one
+    contiguous matrix, so a lookup is a single matrix-vector product. A lookup hits
+    when the best cosine similarity reaches the threshold. The least recently used
+    entry is evicted when the cache is full.
+    
+    With lsh_tables > 0, entries are also bucketed by random-hyperplane signatures
+    and a lookup only scores entries that share a bucket with the query in at least
+    one table, so large caches are not scanned in full. With use_faiss, lookups
+    run an exact FAISS inner-product search over all entries instead.
+    
+    A persisted cache is written every save_every puts and at interpreter exit,
+    from a snapshot taken under the lock, so lookups are not blocked by disk I/O.
+    """
+    
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        threshold: float = DEFAULT_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        persist_path: Optional[str] = None,
+        lsh_tables: int = 0,
+        lsh_bits: int = DEFAULT_LSH_BITS,
+        use_faiss: bool = False,
+        save_every: int = DEFAULT_SAVE_EVERY
+    ):
+        """
+        Args:
+            model_name: Sentence transformer used to embed queries
+            threshold: Minimum cosine similarity for a hit
+            max_entries: Number of entries kept before evicting
+            persist_path: Path prefix for the saved matrix and values; not saved when None
+            lsh_tables: Number of LSH hash tables; 0 scores every entry
+            lsh_bits: Hyperplanes per LSH table, at most 62
+            use_faiss: Search with a FAISS IndexFlatIP when faiss is installed
+            save_every: Puts between writes of a persisted cache
+        """
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.save_every = max(1, save_every)
+        
+        self._model = None
+        self._matrix: Optional[np.ndarray] = None
+        self._values: List[Any] = []
+        self._size = 0
+        # Slot indices, least recently used first
+        self._lru: Deque[int] = deque()
+        self._lock = threading.Lock()
+        # Puts since the last save; writes are serialized by their own lock
+        self._unsaved = 0
+        self._save_lock = threading.Lock()
+        
+        self.lsh_tables = lsh_tables
+        self.lsh_bits = lsh_bits
+        self._planes: Optional[np.ndarray] = None
+        self._bit_weights = np.left_shift(1, np.arange(lsh_bits, dtype=np.int64))
+        self._buckets: List[Dict[int, Set[int]]] = [{} for _ in range(lsh_tables)]
+        # Bucket key of every slot in each table, so evicted slots can be unbucketed
+        self._slot_keys: Optional[np.ndarray] = None
+        
+        if use_faiss and not FAISS_AVAILABLE:
+            logger.warning("faiss is not installed, semantic cache falls back to NumPy search")
+        self.use_faiss = use_faiss and FAISS_AVAILABLE
+        # Slot ids of the cached embeddings in a flat inner-product index
+        self._index = None
+        
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+    
+    @property
+    def embedding_model(self) -> SentenceTransformer:
+        """Load the embedding model on first use."""
+        if self._model is None:
+            logger.info(f"Loading semantic cache embedding model: {self.model_name}")
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+    
+    def embed(self, query: str) -> np.ndarray:
+        """Embed a query as a normalized float32 vector."""
+        return np.asarray(
+            self.embedding_model.encode(query, normalize_embeddings=True),
+            dtype=np.float32
+        )
+    
+    def get(self, query: str, embedding: Optional[np.ndarray] = None) -> Optional[Tuple[Any, float]]:
+        """Return (value, similarity) of the closest cached query, or None on a miss.
+        
+        Args:
+            query: The user's question in natural language
+            embedding: Embedding of query from embed(); computed here when not given
+        """
+        if embedding is None:
+            embedding = self.embed(query)
+        
+        with self._lock:
+            if not self._size:
+                return None
+            
+            if self._index is not None:
+                sims, ids = self._index.search(embedding.reshape(1, -1), 1)
+                slot, similarity = int(ids[0, 0]), sims[0, 0]
+            elif self.lsh_tables:
+                slots = self._lsh_candidates(embedding)
+                if not len(slots):
+                    return None
+                best, similarity = best_match(self._matrix[slots], embedding)
+                slot = int(slots[best])
+            else:
+                slot, similarity = best_match(self._matrix[:self._size], embedding)
+                slot = int(slot)
+            
+            similarity = float(similarity)
+            if similarity < self.threshold:
+                return None
+            self._lru.remove(slot)
+            self._lru.append(slot)
+            return self._values[slot], similarity
+    
+    def put(self, query: str, value: Any, embedding: Optional[np.ndarray] = None) -> None:
+        """Store value for query, evicting the least recently used entry when full.
+        
+        Args:
+            query: The user's question in natural language
+            value: Value to return for this query and its near-duplicates
+            embedding: Embedding of query from embed(); computed here when not given
+        """
+        if embedding is None:
+            embedding = self.embed(query)
+        
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.empty((self.max_entries, embedding.shape[0]), dtype=np.float32)
+            
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+                self._values.append(value)
+            else:
+                slot = self._lru.popleft()
+                self._values[slot] = value
+                self._lsh_remove(slot)
+                if self._index is not None:
+                    self._index.remove_ids(np.array([slot], dtype=np.int64))
+            
+            self._matrix[slot] = embedding
+            self._lsh_add(slot, embedding)
+            self._index_add(slot)
+            self._lru.append(slot)
+            
+            self._unsaved += 1
+            save_due = bool(self.persist_path) and self._unsaved >= self.save_every
+        
+        if save_due:
+            self.save()
+    
+    def clear(self) -> None:
+        """Drop all cached entries."""
+        with self._lock:
+            self._matrix = None
+            self._values = []
+            self._size = 0
+            self._lru.clear()
+            self._buckets = [{} for _ in range(self.lsh_tables)]
+            self._slot_keys = None
+            self._index = None
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def _index_add(self, slot: int) -> None:
+        """Add a slot's embedding to the FAISS index, creating it on first use."""
+        if not self.use_faiss:
+            return
+        if self._index is None:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(self._matrix.shape[1]))
+        self._index.add_with_ids(self._matrix[slot:slot + 1], np.array([slot], dtype=np.int64))
+    
+    def _lsh_keys(self, embedding: np.ndarray) -> np.ndarray:
+        """Bucket key of an embedding in each LSH table."""
+        if self._planes is None:
+            # Fixed seed so keys stay stable across restarts of a persisted cache
+            rng = np.random.default_rng(0)
+            self._planes = rng.standard_normal(
+                (self.lsh_tables, self.lsh_bits, embedding.shape[0])
+            ).astype(np.float32)
+        return (self._planes @ embedding > 0) @ self._bit_weights
+    
+    def _lsh_candidates(self, embedding: np.ndarray) -> np.ndarray:
+        """Slots sharing a bucket with the embedding in any LSH table."""
+        slots: Set[int] = set()
+        for table, key in zip(self._buckets, self._lsh_keys(embedding).tolist()):
+            slots.update(table.get(key, ()))
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+    
+    def _lsh_add(self, slot: int, embedding: np.ndarray) -> None:
+        """Put a slot into the LSH buckets of its embedding."""
+        if not self.lsh_tables:
+            return
+        if self._slot_keys is None:
+            self._slot_keys = np.zeros((self.max_entries, self.lsh_tables), dtype=np.int64)
+        keys = self._lsh_keys(embedding)
+        self._slot_keys[slot] = keys
+        for table, key in zip(self._buckets, keys.tolist()):
+            table.setdefault(key, set()).add(slot)
+    
+    def _lsh_remove(self, slot: int) -> None:
+        """Take a slot out of the LSH buckets it was added to."""
+        if not self.lsh_tables:
+            return
+        for table, key in zip(self._buckets, self._slot_keys[slot].tolist()):
+            members = table[key]
+            members.discard(slot)
+            if not members:
+                del table[key]
+    
+    def load(self) -> None:
+        """Load entries saved at persist_path, if any."""
+        matrix_path = f"{self.persist_path}.npy"
+        values_path = f"{self.persist_path}.pkl"
+        if not (os.path.exists(matrix_path) and os.path.exists(values_path)):
+            return
+        
+        try:
+            matrix = np.load(matrix_path)
+            with open(values_path, "rb") as f:
+                values, lru = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load semantic cache from {self.persist_path}: {e}")
+            return
+        
+        # Keep the most recently used entries if the saved cache is larger
+        lru = lru[-self.max_entries:]
+        with self._lock:
+            self._matrix = np.empty((self.max_entries, matrix.shape[1]), dtype=np.float32)
+            self._matrix[:len(lru)] = matrix[lru]
+            self._values = [values[slot] for slot in lru]
+            self._size = len(lru)
+            self._lru = deque(range(self._size))
+            self._buckets = [{} for _ in range(self.lsh_tables)]
+            self._index = None
+            for slot in range(self._size):
+                self._lsh_add(slot, self._matrix[slot])
+                self._index_add(slot)
+        logger.info(f"Loaded {self._size} semantic cache entries from {self.persist_path}")
+    
+    def save(self) -> None:
+        """Write entries to persist_path if any were added since the last save."""
+        if not self.persist_path:
+            return
+        
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved or self._matrix is None:
+                    return
+                matrix = self._matrix[:self._size].copy()
+                values = list(self._values)
+                lru = list(self._lru)
+                self._unsaved = 0
+            
+            try:
+                np.save(f"{self.persist_path}.npy", matrix)
+                with open(f"{self.persist_path}.pkl", "wb") as f:
+                    pickle.dump((values, lru), f)
+            except Exception as e:
+                logger.warning(f"Could not save semantic cache to {self.persist_path}: {e}")
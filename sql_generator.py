@@ -19,6 +19,15 @@ from adapters.llm_groq import GroqAdapter
 # Removed iiq_feedback - focusing on core functionality
 from config import settings
 
+# Prompt templates filled in per request
+RETRY_CONTEXT_TEMPLATE = "\n\nRETRY ATTEMPT {attempt}: Previous attempt failed. Please ensure the SQL is syntactically correct and follows MySQL standards."
+
+EXPLANATION_PROMPT_TEMPLATE = """EXPLANATION REQUEST:
+SQL Query: {sql_query}
+Schema Context: {schema_context}
+
+Please explain what this query does in plain English."""
+
 
 class SQLGenerator:
     """Main SQL generation engine that orchestrates all components."""
@@ -38,6 +47,22 @@ class SQLGenerator:
         # Initialize LLM adapter based on configuration
         self.llm_adapter = self._initialize_llm_adapter()
         
+        # Near-duplicate questions reuse earlier SQL, skipping prompt building and the LLM call
+        self.semantic_cache = None
+        if settings.app.semantic_cache_enabled:
+            # Imported here so sentence-transformers and numba only load when the cache is on
+            from semantic_cache import SemanticQueryCache
+            self.semantic_cache = SemanticQueryCache(
+                model_name=settings.vector_db.embedding_model,
+                threshold=settings.app.semantic_cache_threshold,
+                max_entries=settings.app.semantic_cache_size,
+                persist_path=settings.app.semantic_cache_path,
+                save_every=settings.app.semantic_cache_save_every,
+                lsh_tables=settings.app.semantic_cache_lsh_tables,
+                lsh_bits=settings.app.semantic_cache_lsh_bits,
+                use_faiss=settings.app.semantic_cache_faiss
+            )
+        
         logger.info("SQL Generator initialized successfully")
     
     def _initialize_llm_adapter(self):
@@ -61,7 +86,8 @@ class SQLGenerator:
             # Use Groq API with Llama-3.1-8b-instant - ultra-fast and reliable
             adapter = GroqAdapter(
                 api_key=groq_api_key,
-                model_name="openai/gpt-oss-20b"  # Match Groq UI model
+                model_name="openai/gpt-oss-20b",  # Match Groq UI model
+                response_cache_size=settings.llm.response_cache_size
             )
             
             if adapter.is_available():
@@ -131,17 +157,40 @@ class SQLGenerator:
             logger.info(f"SQL_GEN: Starting retry loop (max {max_retries} attempts)")
             
             sql_query = None
-            for attempt in range(max_retries):
+            attempt = 0
+            query_embedding = None
+            if self.semantic_cache is not None:
+                # A failing cache is treated as a miss so generation still reaches the LLM
+                try:
+                    query_embedding = self.semantic_cache.embed(natural_language_query)
+                    cached = self.semantic_cache.get(natural_language_query, query_embedding)
+                except Exception as e:
+                    logger.warning(f"SQL_GEN: Semantic cache lookup failed, treating as a miss: {e}")
+                    cached = None
+                if cached is not None:
+                    sql_query, similarity = cached
+                    logger.info(f"SQL_GEN: Semantic cache hit (similarity {similarity:.3f}), skipping LLM")
+                    result["generation_metadata"]["semantic_cache_hit"] = True
+                    result["generation_metadata"]["semantic_cache_similarity"] = similarity
+            
+            # Built on the first attempt and reused by the retries - the retrieved context is the same
+            complete_prompt = None
+            
+            for attempt in range(max_retries if sql_query is None else 0):
                 result["generation_metadata"]["attempts"] = attempt + 1
                 logger.info(f"SQL_GEN: Attempt {attempt + 1}/{max_retries}")
                 
                 try:
+                    if complete_prompt is None:
+                        # A failed build counts as a failed attempt and is retried
+                        complete_prompt = self.vector_search.generate_prompt_with_definitions(natural_language_query)
+                    
                     logger.info(f"SQL_GEN: Calling _generate_sql_with_llm()")
                     sql_query = self._generate_sql_with_llm(
-                        natural_language_query, attempt
+                        natural_language_query, attempt, complete_prompt=complete_prompt
                     )
                     
-                    if sql_query and sql_query.strip():
+                    if sql_query and not sql_query.isspace():
                         logger.info(f"SQL_GEN: SQL generated successfully on attempt {attempt + 1}")
                         logger.info(f"SQL_GEN: Generated SQL: {sql_query[:100]}...")
                         break
@@ -155,7 +204,7 @@ class SQLGenerator:
                         result["errors"].append(f"All generation attempts failed. Last error: {e}")
                         return result
             
-            if not sql_query or not sql_query.strip():
+            if not sql_query or sql_query.isspace():
                 result["errors"].append("Failed to generate SQL after all attempts")
                 return result
             
@@ -218,6 +267,18 @@ class SQLGenerator:
                 logger.info(f"SQL_GEN: Skipping explanation (include_explanation=False)")
             
             result["success"] = True
+            # Only cache freshly generated SQL that passed validation
+            validation_result = result["validation_result"]
+            if complete_prompt is not None:
+                if validation_result is None or validation_result.get("valid"):
+                    self.llm_adapter.cache_response(complete_prompt, result["sql_query"])
+                    if self.semantic_cache is not None:
+                        try:
+                            self.semantic_cache.put(natural_language_query, result["sql_query"], query_embedding)
+                        except Exception as e:
+                            logger.warning(f"SQL_GEN: Could not store SQL in semantic cache: {e}")
+                else:
+                    self.llm_adapter.invalidate_response(complete_prompt)
             logger.info(f"SQL_GEN: SQL generation completed successfully!")
             logger.info(f"SQL_GEN: Final result summary:")
             logger.info(f"   - SQL length: {len(result['sql_query'])}")
@@ -235,18 +296,27 @@ class SQLGenerator:
         self, 
         natural_language_query: str, 
         attempt: int = 0,
-        translation_result: Optional[Dict[str, Any]] = None
+        translation_result: Optional[Dict[str, Any]] = None,
+        complete_prompt: Optional[str] = None
     ) -> str:
-        """Generate SQL using the LLM adapter with enhanced prompts."""
+        """Generate SQL using the LLM adapter with enhanced prompts.
+        
+        Args:
+            natural_language_query: The user's question in natural language
+            attempt: Zero-based attempt number, used to add retry context
+            translation_result: Unused, kept for compatibility
+            complete_prompt: Prompt already built for this query; built here when not given
+        """
         
         logger.info(f"LLM_GEN: Starting LLM SQL generation")
         logger.info(f"LLM_GEN: Query: '{natural_language_query}'")
         logger.info(f"LLM_GEN: Attempt: {attempt + 1}")
         
-        # Build prompt using two-step Vector DB search
-        logger.info(f"LLM_GEN: Building prompt using two-step Vector DB search")
-        # Get complete prompt from Vector DB (includes schema + training + prompt template)
-        complete_prompt = self.vector_search.generate_prompt_with_definitions(natural_language_query)
+        if complete_prompt is None:
+            # Build prompt using two-step Vector DB search
+            logger.info(f"LLM_GEN: Building prompt using two-step Vector DB search")
+            # Get complete prompt from Vector DB (includes schema + training + prompt template)
+            complete_prompt = self.vector_search.generate_prompt_with_definitions(natural_language_query)
         
         logger.info(f"LLM_GEN: Prompt components:")
         logger.info(f"   - Complete prompt length: {len(complete_prompt)}")
@@ -258,7 +328,7 @@ class SQLGenerator:
         # Add retry context for subsequent attempts
         if attempt > 0:
             logger.info(f"LLM_GEN: Adding retry context for attempt {attempt + 1}")
-            retry_context = f"\n\nRETRY ATTEMPT {attempt}: Previous attempt failed. Please ensure the SQL is syntactically correct and follows MySQL standards."
+            retry_context = RETRY_CONTEXT_TEMPLATE.format(attempt=attempt)
             prompt += retry_context
         
         logger.info(f"LLM_GEN: Final prompt length: {len(prompt)}")
@@ -289,8 +359,10 @@ class SQLGenerator:
                 error_lower = error.lower()
                 
                 # Fix missing semicolon
-                if "semicolon" in error_lower and not fixed_sql.strip().endswith(';'):
-                    fixed_sql = fixed_sql.strip() + ';'
+                if "semicolon" in error_lower:
+                    stripped_sql = fixed_sql.strip()
+                    if not stripped_sql.endswith(';'):
+                        fixed_sql = stripped_sql + ';'
                 
                 # Fix unmatched quotes
                 if "quote" in error_lower:
@@ -317,11 +389,7 @@ class SQLGenerator:
     def _generate_explanation(self, sql_query: str, schema_context: str) -> str:
         """Generate explanation for the SQL query."""
         try:
-            explanation_prompt = f"""EXPLANATION REQUEST:
-SQL Query: {sql_query}
-Schema Context: {schema_context}
-
-Please explain what this query does in plain English."""
+            explanation_prompt = EXPLANATION_PROMPT_TEMPLATE.format(sql_query=sql_query, schema_context=schema_context)
             
             if hasattr(self.llm_adapter, 'generate_sql'):
                 return self.llm_adapter.generate_sql(explanation_prompt)
@@ -7,12 +7,80 @@ Step 2: Table Names → Table Definitions
 
 import json
 import os
-from typing import Dict, List, Any, Optional
+import re
+from typing import Dict, Iterator, List, Any, Optional
 from loguru import logger
 import chromadb
 from chromadb.config import Settings
 
 
+# Fixed chunks of the definitions prompt, joined around the per-request parts.
+# Everything that is the same for every query comes first, so LLM providers
+# that cache prompts by prefix can reuse it; table definitions and the user
+# request follow.
+DEFINITIONS_PROMPT_HEAD = """
+You are a MySQL expert, you need to write query for me in mysql.
+
+Key points to remember:
+- Always use proper JOINs when accessing multiple tables
+- Include WHERE clauses for active users (i.inactive = 0 for active users)
+- Use DISTINCT when appropriate to avoid duplicates
+- Follow proper MySQL syntax and best practices
+"""
+
+DEFINITIONS_PROMPT_TABLES = """
+You do have the following tables with their complete definitions:
+"""
+
+DEFINITIONS_PROMPT_REQUEST = """
+
+Based on these table definitions and training examples, generate the appropriate SQL query for the user's request.
+
+User Request: """
+
+DEFINITIONS_PROMPT_TAIL = """
+
+Generate ONLY the SQL query (no explanations or additional text):
+"""
+
+# Batch variant: several numbered requests answered in one completion
+DEFINITIONS_BATCH_REQUEST = """
+
+Based on these table definitions and training examples, generate one SQL query for each numbered user request.
+
+User Requests:"""
+
+DEFINITIONS_BATCH_TAIL = """
+
+For each request, write its number in brackets followed by ONLY its SQL query, e.g. "[1] SELECT ...;".
+No explanations or additional text:
+"""
+
+# "[n]" marker at the start of an answer in a batch response
+BATCH_ANSWER_RE = re.compile(r"^\s*\[(\d+)\]", re.MULTILINE)
+
+
+def parse_batch_response(response: str, count: int) -> List[str]:
+    """Split a batch response into the SQL for each numbered request.
+    
+    Args:
+        response: LLM output for a prompt from generate_batch_prompt_with_definitions
+        count: Number of requests in the batch
+        
+    Returns:
+        SQL for requests 1..count in order; empty for requests the model skipped
+    """
+    answers = [""] * count
+    # re.split with one group gives [preamble, n1, answer1, n2, answer2, ...]
+    pieces = BATCH_ANSWER_RE.split(response.replace("```sql", "").replace("```", ""))
+    for number, answer in zip(pieces[1::2], pieces[2::2]):
+        index = int(number) - 1
+        if 0 <= index < count and not answers[index]:
+            # Only trim the ends; inner whitespace may sit inside string literals
+            answers[index] = answer.strip()
+    return answers
+
+
 class TwoStepVectorDBSearch:
     """Two-step Vector DB search: Query → Tables, Tables → Definitions."""
     
@@ -22,34 +90,30 @@ class TwoStepVectorDBSearch:
             path="./chromadb",
             settings=Settings(allow_reset=False, anonymized_telemetry=False)
         )
+        self._training_example_text: Optional[str] = None
+        self._static_prefix: Optional[str] = None
         self._initialize_collections()
         
     def _initialize_collections(self):
         """Initialize Vector DB collections."""
         try:
+            existing = {collection.name for collection in self.vector_db_client.list_collections()}
+            
+            def open_collection(name: str):
+                if name in existing:
+                    logger.info(f"Using existing {name} collection")
+                else:
+                    logger.info(f"Creating new {name} collection")
+                return self.vector_db_client.get_or_create_collection(name)
+            
             # Collection 1: Query to Table Names mapping
-            try:
-                self.query_to_tables_collection = self.vector_db_client.get_collection("query_to_tables")
-                logger.info("Using existing query_to_tables collection")
-            except:
-                logger.info("Creating new query_to_tables collection")
-                self.query_to_tables_collection = self.vector_db_client.create_collection("query_to_tables")
+            self.query_to_tables_collection = open_collection("query_to_tables")
             
             # Collection 2: Table Names to Definitions mapping
-            try:
-                self.table_to_definitions_collection = self.vector_db_client.get_collection("table_to_definitions")
-                logger.info("Using existing table_to_definitions collection")
-            except:
-                logger.info("Creating new table_to_definitions collection")
-                self.table_to_definitions_collection = self.vector_db_client.create_collection("table_to_definitions")
+            self.table_to_definitions_collection = open_collection("table_to_definitions")
             
             # Collection 3: Training Examples
-            try:
-                self.training_examples_collection = self.vector_db_client.get_collection("training_examples")
-                logger.info("Using existing training_examples collection")
-            except:
-                logger.info("Creating new training_examples collection")
-                self.training_examples_collection = self.vector_db_client.create_collection("training_examples")
+            self.training_examples_collection = open_collection("training_examples")
                 
             logger.info("Vector DB collections initialized successfully")
             
@@ -161,80 +225,96 @@ class TwoStepVectorDBSearch:
     
     def generate_prompt_with_definitions(self, query: str) -> str:
         """Generate prompt using two-step Vector DB search."""
+        return "".join(self.iter_prompt_with_definitions(query))
+    
+    def iter_prompt_with_definitions(self, query: str) -> Iterator[str]:
+        """Yield the sections of the two-step search prompt in order.
+        
+        Joining the sections gives generate_prompt_with_definitions' result;
+        callers that write the prompt out piecewise can skip building it.
+        """
         result = self.search_query_to_definitions(query)
         
         if not result["success"]:
-            return f"Error: {result['error']}"
+            yield f"Error: {result['error']}"
+            return
         
-        # Build table definitions text
-        table_definitions_text = ""
+        # Expert preamble and training example, then the table definitions
+        yield self._get_static_prefix()
         for table_name, definition in result["table_definitions"].items():
-            table_definitions_text += f"\n\nCREATE TABLE `{table_name}`:\n{definition}\n"
+            yield f"\n\nCREATE TABLE `{table_name}`:\n{definition}\n"
         
-        # Get training examples from Vector DB
-        training_examples_text = self._get_training_examples_from_vector_db(query)
+        yield DEFINITIONS_PROMPT_REQUEST
+        yield query
+        yield DEFINITIONS_PROMPT_TAIL
+    
+    def generate_batch_prompt_with_definitions(self, queries: List[str]) -> str:
+        """Generate one prompt asking for the SQL of several queries.
         
-        # Generate prompt
-        prompt = f"""
-You are a MySQL expert, you need to write query for me in mysql.
-
-You do have the following tables with their complete definitions:
-
-{table_definitions_text}
-
-{training_examples_text}
-
-Based on these table definitions and training examples, generate the appropriate SQL query for the user's request.
-
-Key points to remember:
-- Always use proper JOINs when accessing multiple tables
-- Include WHERE clauses for active users (i.inactive = 0 for active users)
-- Use DISTINCT when appropriate to avoid duplicates
-- Follow proper MySQL syntax and best practices
-
-User Request: {query}
-
-Generate ONLY the SQL query (no explanations or additional text):
-"""
+        The static prefix and the union of the queries' table definitions are
+        emitted once, followed by the queries numbered from 1. Split the
+        response with parse_batch_response.
+        """
+        table_definitions: Dict[str, str] = {}
+        for query in queries:
+            result = self.search_query_to_definitions(query)
+            if result["success"]:
+                for table_name, definition in result["table_definitions"].items():
+                    table_definitions.setdefault(table_name, definition)
+        
+        if not table_definitions:
+            return "Error: No tables found for any query in the batch"
         
-        return prompt
+        parts = [self._get_static_prefix()]
+        for table_name, definition in table_definitions.items():
+            parts.append(f"\n\nCREATE TABLE `{table_name}`:\n{definition}\n")
+        
+        parts.append(DEFINITIONS_BATCH_REQUEST)
+        for number, query in enumerate(queries, 1):
+            parts.append(f"\n[{number}] {query}")
+        parts.append(DEFINITIONS_BATCH_TAIL)
+        return "".join(parts)
     
-    def _get_training_examples_from_vector_db(self, query: str) -> str:
-        """Get relevant training examples from Vector DB."""
-        try:
-            # Search for training examples similar to the query
-            results = self.training_examples_collection.query(
-                query_texts=[query],
-                n_results=1,
-                include=['documents', 'metadatas', 'distances']
-            )
+    def _get_static_prefix(self) -> str:
+        """Prompt text up to the table definitions, built once.
+        
+        Nothing before the table definitions depends on the query: the
+        training example block is included whenever the training collection
+        has an entry. The prefix is cached once it includes the example, which
+        skips a Vector DB query per prompt; until then the collection is
+        checked again on every prompt, so filling it later takes effect.
+        """
+        if self._static_prefix is None:
+            try:
+                has_training_example = self.training_examples_collection.count() > 0
+            except Exception as e:
+                logger.error(f"Error getting training examples from Vector DB: {e}")
+                return DEFINITIONS_PROMPT_HEAD + DEFINITIONS_PROMPT_TABLES
             
-            if results['documents'] and results['documents'][0]:
-                # Get the training example
-                training_example = results['documents'][0][0]
-                similarity_score = 1 - results['distances'][0][0]  # Convert distance to similarity
-                
-                # Get the corresponding SQL from iiq_training_examples.py
-                from iiq_training_examples import IIQTrainingExamples
-                training_data = IIQTrainingExamples()
-                example_data = training_data.get_training_example()
-                
-                training_examples_text = f"""
+            if not has_training_example:
+                # Not cached, so the example appears once the collection is populated
+                return DEFINITIONS_PROMPT_HEAD + DEFINITIONS_PROMPT_TABLES
+            
+            self._static_prefix = f"""{DEFINITIONS_PROMPT_HEAD}
 ## RELEVANT TRAINING EXAMPLE:
 
-### Example (Similarity: {similarity_score:.3f}):
-Q: {example_data['natural_language']}
+### Example:
+{self._get_training_example_text()}{DEFINITIONS_PROMPT_TABLES}"""
+        return self._static_prefix
+    
+    def _get_training_example_text(self) -> str:
+        """Q/A/explanation block of the training example, formatted on first use."""
+        if self._training_example_text is None:
+            # Get the corresponding SQL from iiq_training_examples.py
+            from iiq_training_examples import IIQTrainingExamples
+            example_data = IIQTrainingExamples().get_training_example()
+            
+            self._training_example_text = f"""Q: {example_data['natural_language']}
 A: {example_data['sql_query']}
 
 Explanation: {example_data['explanation']}
 """
-                return training_examples_text
-            else:
-                return ""
-                
-        except Exception as e:
-            logger.error(f"Error getting training examples from Vector DB: {e}")
-            return ""
+        return self._training_example_text
     
     def populate_collections(self) -> bool:
         """Populate Vector DB collections with sample data."""
@@ -1,11 +1,223 @@
 """SQL validator and sanitizer for security and correctness."""
 
 import re
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from itertools import compress
 import sqlparse
 from sqlparse import sql, tokens
 from typing import Dict, Any, List, Optional, Set, Tuple
 from loguru import logger
-from enum import Enum
+from enum import Enum, IntEnum
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+try:
+    import hyperscan
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    HYPERSCAN_AVAILABLE = False
+
+
+# SQL injection patterns, compiled once at import. Each is paired with a
+# lower-case substring it cannot match without, so the regex is skipped
+# for queries that don't contain the trigger.
+INJECTION_PATTERNS = [
+    (trigger, re.compile(pattern, re.IGNORECASE)) for trigger, pattern in (
+        ("--", r";\s*--"),  # Comment injection
+        ("union", r"union\s+select"),  # Union-based injection
+        ("'", r"'\s*or\s+'.*'='"),  # Classic SQL injection
+        ("'", r"'\s*or\s+1\s*=\s*1"),  # Tautology injection
+        ("exec", r"exec\s*\("),  # Dynamic SQL execution
+        ("char", r"char\s*\("),  # Character-based obfuscation
+        ("cast", r"cast\s*\("),  # Type casting attacks
+    )
+]
+
+
+def _compile_injection_database():
+    """Compile all injection patterns into one Hyperscan database, or None if unavailable."""
+    if not HYPERSCAN_AVAILABLE:
+        return None
+    
+    database = hyperscan.Database()
+    database.compile(
+        expressions=[pattern.pattern.encode() for _, pattern in INJECTION_PATTERNS],
+        ids=list(range(len(INJECTION_PATTERNS))),
+        elements=len(INJECTION_PATTERNS),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(INJECTION_PATTERNS)
+    )
+    return database
+
+
+INJECTION_DATABASE = _compile_injection_database()
+
+
+def find_injection_patterns(query: str, query_lower: str) -> List[str]:
+    """Return the source of every injection pattern found in the query, in declaration order.
+    
+    Uses one Hyperscan pass over the query when available, otherwise the
+    trigger-gated regexes one at a time.
+    """
+    if INJECTION_DATABASE is not None:
+        matched = set()
+        INJECTION_DATABASE.scan(
+            query.encode('utf-8', errors='replace'),
+            match_event_handler=lambda pattern_id, start, end, flags, context: matched.add(pattern_id)
+        )
+        return [INJECTION_PATTERNS[i][1].pattern for i in sorted(matched)]
+    
+    return [
+        pattern.pattern for trigger, pattern in INJECTION_PATTERNS
+        if trigger in query_lower and pattern.search(query)
+    ]
+
+
+# Sanitization: runs of whitespace and comments collapse to one space in a single pass
+SANITIZE_RE = re.compile(r'(?:\s|--[^\n]*|/\*.*?\*/)+', re.DOTALL)
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+# Fixed check messages, selected per query with itertools.compress
+STRUCTURE_SUGGESTIONS = (
+    "Consider specifying column names instead of using SELECT *",
+    "Consider adding ORDER BY for consistent results with GROUP BY",
+    "Consider using table aliases for better readability",
+)
+STRUCTURE_WARNINGS = (
+    "Query has many joins, consider breaking into smaller queries",
+    "Multiple LIKE operations with wildcards may be slow",
+)
+PERFORMANCE_WARNINGS = (
+    "SELECT * can impact performance, specify needed columns",
+    "Leading wildcard in LIKE clause prevents index usage",
+)
+PERFORMANCE_SUGGESTIONS = (
+    "Consider adding TOP/LIMIT clause with ORDER BY for better performance",
+    "Multiple OR conditions may benefit from UNION or IN clause",
+    "NOT IN with NULL values can cause unexpected results, consider NOT EXISTS",
+)
+
+# Functions that prevent index usage when applied to columns in a WHERE clause
+WHERE_FUNCTIONS = ('UPPER', 'LOWER', 'SUBSTRING', 'CONVERT', 'CAST')
+WHERE_RE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+WHERE_FUNCTION_RE = re.compile(r'\b(' + '|'.join(WHERE_FUNCTIONS) + r')\s*\(', re.IGNORECASE)
+
+
+@dataclass(slots=True)
+class CheckResult:
+    """Findings from a single validation check."""
+    warnings: List[str] = field(default_factory=list)
+    suggestions: List[str] = field(default_factory=list)
+    issues: List[str] = field(default_factory=list)
+    # Failures that make the query invalid at every validation level
+    errors: List[str] = field(default_factory=list)
+    risk_level: str = "low"
+
+
+def check_step(fail_closed: bool = False):
+    """Turn exceptions raised by a validation check into a CheckResult.
+    
+    Args:
+        fail_closed: Report a failure as an error that blocks the query instead
+            of a warning (used for the security check, which must not pass silently)
+    """
+    def decorator(check):
+        @wraps(check)
+        def wrapper(*args, **kwargs) -> CheckResult:
+            try:
+                return check(*args, **kwargs)
+            except Exception as e:
+                logger.warning("Validation step {} failed: {}", check.__name__, e)
+                message = f"Validation step {check.__name__} failed: {e}"
+                if fail_closed:
+                    return CheckResult(issues=[message], errors=[message], risk_level="high")
+                return CheckResult(warnings=[message])
+        return wrapper
+    return decorator
+
+
+class TermScanner:
+    """Find which of a fixed set of substrings occur in a text.
+    
+    Uses a single Aho-Corasick pass when pyahocorasick is installed and
+    falls back to one substring test per term otherwise.
+    """
+    
+    def __init__(self, terms: Dict[str, str]):
+        """
+        Args:
+            terms: Upper-case search string -> value reported when it is found
+        """
+        self.terms = terms
+        self._automaton = None
+        
+        if AHOCORASICK_AVAILABLE:
+            self._automaton = ahocorasick.Automaton()
+            for needle, value in terms.items():
+                self._automaton.add_word(needle, value)
+            self._automaton.make_automaton()
+    
+    def find(self, text_upper: str) -> Set[str]:
+        """Return the values of all terms found in the upper-cased text."""
+        if self._automaton is not None:
+            return {value for _, value in self._automaton.iter(text_upper)}
+        return {value for needle, value in self.terms.items() if needle in text_upper}
+
+
+@lru_cache(maxsize=1000)
+def parse_statements(query: str) -> Tuple[sql.Statement, ...]:
+    """Parse a query with sqlparse, memoized since the same SQL is often checked repeatedly.
+    
+    Callers must treat the returned statements as read-only.
+    """
+    return tuple(sqlparse.parse(query))
+
+
+@lru_cache(maxsize=2048)
+def format_sql(query: str) -> str:
+    """Reindent a query with sqlparse, memoized since formatting is deterministic."""
+    return sqlparse.format(
+        query,
+        reindent=True,
+        keyword_case='upper',
+        identifier_case='lower',
+        strip_comments=False,
+        use_space_around_operators=True
+    )
+
+
+# Keywords upper-cased by the format_query fast path; string literals are matched
+# first so keywords inside them are left alone
+KEYWORD_CASE_RE = re.compile(
+    r"'(?:[^'\\]|\\.)*'|\b(SELECT|DISTINCT|FROM|WHERE|AND|OR|NOT|IN|IS|NULL|LIKE|BETWEEN|"
+    r"JOIN|INNER|LEFT|RIGHT|OUTER|CROSS|ON|AS|GROUP|ORDER|BY|HAVING|LIMIT|OFFSET|UNION|ALL|"
+    r"CASE|WHEN|THEN|ELSE|END|EXISTS|ASC|DESC|WITH|COUNT|SUM|AVG|MIN|MAX)\b",
+    re.IGNORECASE
+)
+
+
+# Everything the structure/performance/complexity checks look for, classified in
+# one scan: keywords, SELECT *, leading LIKE wildcards, function calls and '%'
+KEYWORD_RE = re.compile(
+    r"\b(?:SELECT\s+\*|LIKE\s+'%|(?:COUNT|SUM|AVG|MAX|MIN|OVER)\(|"
+    r"(?:ORDER\s+BY|GROUP\s+BY|NOT\s+IN|SELECT|FROM|WHERE|JOIN|UNION|HAVING|CASE|"
+    r"LIKE|OR|AS|LIMIT|TOP)\b)|%",
+    re.IGNORECASE
+)
+
+# Compound matches that also count towards their leading keyword / '%'
+KEYWORD_IMPLIES = {
+    "SELECT *": ("SELECT",),
+    "LIKE '%": ("LIKE", "%"),
+}
 
 
 class ValidationLevel(Enum):
@@ -15,6 +227,21 @@ class ValidationLevel(Enum):
     STRICT = "strict"
 
 
+class ComplexityFactor(IntEnum):
+    """Query complexity factors, used as indexes into COMPLEXITY_WEIGHTS."""
+    JOINS = 0
+    SUBQUERIES = 1
+    UNIONS = 2
+    AGGREGATIONS = 3
+    CONDITIONS = 4
+    CASE_STATEMENTS = 5
+    WINDOW_FUNCTIONS = 6
+
+
+# Weight of each complexity factor, indexed by ComplexityFactor
+COMPLEXITY_WEIGHTS = (2, 3, 2, 1, 1, 2, 3)
+
+
 class SQLValidator:
     """Validate and sanitize SQL queries for security and correctness."""
     
@@ -36,10 +263,19 @@ class SQLValidator:
         'SELECT', 'WITH'  # Common Table Expressions
     }
     
+    # Queries at least this long run the read-only checks on worker threads
+    PARALLEL_CHECK_MIN_LENGTH = 20000
+    
     def __init__(self, validation_level: ValidationLevel = ValidationLevel.STANDARD):
         """Initialize SQL validator."""
         self.validation_level = validation_level
-        logger.info(f"SQL Validator initialized with {validation_level.value} validation level")
+        
+        # Dangerous keywords and system objects are found in one pass over the query
+        security_terms = {keyword: keyword for keyword in self.DANGEROUS_KEYWORDS}
+        security_terms.update({sys_obj.upper(): sys_obj for sys_obj in self.SYSTEM_OBJECTS})
+        self._security_scanner = TermScanner(security_terms)
+        
+        logger.info("SQL Validator initialized with {} validation level", validation_level.value)
     
     def validate_query(self, query: str) -> Dict[str, Any]:
         """
@@ -62,31 +298,53 @@ class SQLValidator:
         }
         
         try:
+            # Upper-cased once and shared by every check below
+            query_upper = query.upper()
+            keyword_counts = self._count_keywords(query)
+            
+            # Parse the query once - the syntax check and every later step share it
+            parsed = parse_statements(query)
+            
             # Basic syntax validation
-            syntax_result = self._validate_syntax(query)
+            syntax_result = self._validate_syntax(query, query_upper, parsed)
             if not syntax_result["valid"]:
                 result["valid"] = False
                 result["errors"].extend(syntax_result["errors"])
                 return result
             
-            # Parse the query
-            parsed = sqlparse.parse(query)
             if not parsed:
                 result["valid"] = False
                 result["errors"].append("Failed to parse SQL query")
                 return result
             
+            # Security, structure and performance checks are read-only and independent
+            checks = (
+                (self._validate_security, (query, query_upper, parsed[0])),
+                (self._validate_structure, (keyword_counts,)),
+                (self._validate_performance, (query_upper, keyword_counts)),
+            )
+            if len(query) >= self.PARALLEL_CHECK_MIN_LENGTH:
+                with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+                    futures = [executor.submit(check, *args) for check, args in checks]
+                    security_result, structure_result, performance_result = [f.result() for f in futures]
+            else:
+                security_result, structure_result, performance_result = [check(*args) for check, args in checks]
+            
             # Security validation
-            security_result = self._validate_security(query, parsed[0])
-            result["security_issues"].extend(security_result["issues"])
-            result["warnings"].extend(security_result["warnings"])
+            result["security_issues"].extend(security_result.issues)
+            result["warnings"].extend(security_result.warnings)
             
-            if security_result["risk_level"] == "high":
+            # A security check that could not run blocks the query regardless of level
+            if security_result.errors:
+                result["valid"] = False
+                result["errors"].extend(security_result.errors)
+            
+            if security_result.risk_level == "high":
                 result["risk_level"] = "high"
                 if self.validation_level == ValidationLevel.STRICT:
                     result["valid"] = False
                     result["errors"].append("High-risk query blocked by strict validation")
-            elif security_result["risk_level"] == "medium":
+            elif security_result.risk_level == "medium":
                 result["risk_level"] = "medium"
             
             # Statement type validation
@@ -96,29 +354,38 @@ class SQLValidator:
                 result["errors"].append(f"Statement type not allowed: {statement_result['type']}")
             
             # Structure validation
-            structure_result = self._validate_structure(parsed[0])
-            result["warnings"].extend(structure_result["warnings"])
-            result["suggestions"].extend(structure_result["suggestions"])
+            result["warnings"].extend(structure_result.warnings)
+            result["suggestions"].extend(structure_result.suggestions)
             
             # Performance validation
-            performance_result = self._validate_performance(parsed[0])
-            result["warnings"].extend(performance_result["warnings"])
-            result["suggestions"].extend(performance_result["suggestions"])
+            result["warnings"].extend(performance_result.warnings)
+            result["suggestions"].extend(performance_result.suggestions)
             
             # Sanitization
             result["sanitized_query"] = self._sanitize_query(query, parsed[0])
             
         except Exception as e:
-            logger.error(f"Error validating query: {e}")
+            logger.error("Error validating query: {}", e)
             result["valid"] = False
             result["errors"].append(f"Validation error: {str(e)}")
         
         return result
     
-    def _validate_syntax(self, query: str) -> Dict[str, Any]:
+    @staticmethod
+    def _count_keywords(query: str) -> Counter:
+        """Count SQL keywords and features in a single scan (whitespace normalized to one space)."""
+        counts = Counter()
+        for match in KEYWORD_RE.finditer(query):
+            # Interned so lookups with the literal keys in the checks hit on identity
+            key = sys.intern(WHITESPACE_RE.sub(' ', match.group(0).upper()))
+            counts[key] += 1
+            for implied in KEYWORD_IMPLIES.get(key, ()):
+                counts[implied] += 1
+        return counts
+    
+    def _validate_syntax(self, query: str, query_upper: str, parsed: Tuple[sql.Statement, ...]) -> Dict[str, Any]:
         """Validate basic SQL syntax."""
         try:
-            parsed = sqlparse.parse(query)
             if not parsed:
                 return {"valid": False, "errors": ["Empty or invalid SQL query"]}
             
@@ -136,7 +403,7 @@ class SQLValidator:
                 errors.append("Unmatched single quotes")
             
             # Check for basic SQL structure
-            query_upper = query.upper().strip()
+            query_upper = query_upper.strip()
             if not any(query_upper.startswith(stmt) for stmt in ['SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE']):
                 errors.append("Query does not start with a recognized SQL statement")
             
@@ -145,17 +412,19 @@ class SQLValidator:
         except Exception as e:
             return {"valid": False, "errors": [f"Syntax validation error: {str(e)}"]}
     
-    def _validate_security(self, query: str, parsed_query) -> Dict[str, Any]:
+    @check_step(fail_closed=True)
+    def _validate_security(self, query: str, query_upper: str, parsed_query) -> CheckResult:
         """Validate query for security issues."""
         issues = []
         warnings = []
         risk_level = "low"
         
-        query_upper = query.upper()
+        query_lower = query.lower()
+        found_terms = self._security_scanner.find(query_upper)
         
         # Check for dangerous keywords
         for keyword in self.DANGEROUS_KEYWORDS:
-            if keyword in query_upper:
+            if keyword in found_terms:
                 if keyword in ['DROP', 'DELETE', 'TRUNCATE', 'ALTER']:
                     issues.append(f"Dangerous keyword detected: {keyword}")
                     risk_level = "high"
@@ -168,25 +437,14 @@ class SQLValidator:
         
         # Check for system object access
         for sys_obj in self.SYSTEM_OBJECTS:
-            if sys_obj.lower() in query.lower():
+            if sys_obj in found_terms:
                 issues.append(f"Access to system object: {sys_obj}")
                 risk_level = "high"
         
         # Check for SQL injection patterns
-        injection_patterns = [
-            r";\s*--",  # Comment injection
-            r"union\s+select",  # Union-based injection
-            r"'\s*or\s+'.*'='",  # Classic SQL injection
-            r"'\s*or\s+1\s*=\s*1",  # Tautology injection
-            r"exec\s*\(",  # Dynamic SQL execution
-            r"char\s*\(",  # Character-based obfuscation
-            r"cast\s*\(",  # Type casting attacks
-        ]
-        
-        for pattern in injection_patterns:
-            if re.search(pattern, query, re.IGNORECASE):
-                issues.append(f"Potential SQL injection pattern detected: {pattern}")
-                risk_level = "high"
+        for pattern in find_injection_patterns(query, query_lower):
+            issues.append(f"Potential SQL injection pattern detected: {pattern}")
+            risk_level = "high"
         
         # Check for excessive wildcards
         if query.count('*') > 3:
@@ -197,11 +455,7 @@ class SQLValidator:
             issues.append("UPDATE/DELETE without WHERE clause is dangerous")
             risk_level = "high"
         
-        return {
-            "issues": issues,
-            "warnings": warnings,
-            "risk_level": risk_level
-        }
+        return CheckResult(warnings=warnings, issues=issues, risk_level=risk_level)
     
     def _validate_statement_types(self, parsed_query) -> Dict[str, Any]:
         """Validate that only allowed statement types are used."""
@@ -224,82 +478,52 @@ class SQLValidator:
             "type": statement_type
         }
     
-    def _validate_structure(self, parsed_query) -> Dict[str, Any]:
+    @check_step()
+    def _validate_structure(self, keyword_counts: Counter) -> CheckResult:
         """Validate query structure and provide suggestions."""
-        warnings = []
-        suggestions = []
-        
-        query_str = str(parsed_query).upper()
-        
         # Check for potential issues
-        if 'SELECT *' in query_str:
-            suggestions.append("Consider specifying column names instead of using SELECT *")
-        
-        if 'ORDER BY' not in query_str and 'GROUP BY' in query_str:
-            suggestions.append("Consider adding ORDER BY for consistent results with GROUP BY")
-        
-        if query_str.count('JOIN') > 5:
-            warnings.append("Query has many joins, consider breaking into smaller queries")
-        
-        if 'LIKE' in query_str and query_str.count('%') > 3:
-            warnings.append("Multiple LIKE operations with wildcards may be slow")
-        
-        # Check for proper aliasing
-        if ' JOIN ' in query_str and ' AS ' not in query_str:
-            suggestions.append("Consider using table aliases for better readability")
-        
-        return {
-            "warnings": warnings,
-            "suggestions": suggestions
-        }
+        suggestions = list(compress(STRUCTURE_SUGGESTIONS, (
+            keyword_counts['SELECT *'],
+            not keyword_counts['ORDER BY'] and keyword_counts['GROUP BY'],
+            keyword_counts['JOIN'] and not keyword_counts['AS'],  # Check for proper aliasing
+        )))
+        warnings = list(compress(STRUCTURE_WARNINGS, (
+            keyword_counts['JOIN'] > 5,
+            keyword_counts['LIKE'] and keyword_counts['%'] > 3,
+        )))
+        
+        return CheckResult(warnings=warnings, suggestions=suggestions)
     
-    def _validate_performance(self, parsed_query) -> Dict[str, Any]:
+    @check_step()
+    def _validate_performance(self, query_upper: str, keyword_counts: Counter) -> CheckResult:
         """Validate query for performance issues."""
-        warnings = []
-        suggestions = []
-        
-        query_str = str(parsed_query).upper()
-        
         # Check for performance anti-patterns
-        if 'SELECT *' in query_str:
-            warnings.append("SELECT * can impact performance, specify needed columns")
-        
-        if 'LIKE' in query_str and "'%'" in query_str.replace("'%", "").replace("%'", ""):
-            warnings.append("Leading wildcard in LIKE clause prevents index usage")
-        
-        if 'ORDER BY' in query_str and 'LIMIT' not in query_str and 'TOP' not in query_str:
-            suggestions.append("Consider adding TOP/LIMIT clause with ORDER BY for better performance")
-        
-        if query_str.count('OR') > 3:
-            suggestions.append("Multiple OR conditions may benefit from UNION or IN clause")
-        
-        if 'NOT IN' in query_str:
-            suggestions.append("NOT IN with NULL values can cause unexpected results, consider NOT EXISTS")
-        
-        # Check for functions in WHERE clause
-        function_patterns = [
-            'UPPER(', 'LOWER(', 'SUBSTRING(', 'CONVERT(', 'CAST('
-        ]
-        
-        for pattern in function_patterns:
-            if pattern in query_str and 'WHERE' in query_str:
-                warnings.append(f"Function {pattern} in WHERE clause may prevent index usage")
-        
-        return {
-            "warnings": warnings,
-            "suggestions": suggestions
-        }
+        warnings = list(compress(PERFORMANCE_WARNINGS, (
+            keyword_counts['SELECT *'],
+            keyword_counts["LIKE '%"],
+        )))
+        suggestions = list(compress(PERFORMANCE_SUGGESTIONS, (
+            keyword_counts['ORDER BY'] and not keyword_counts['LIMIT'] and not keyword_counts['TOP'],
+            keyword_counts['OR'] > 3,
+            keyword_counts['NOT IN'],
+        )))
+        
+        # Check for functions in WHERE clause - only text after WHERE is scanned
+        if keyword_counts['WHERE']:
+            where_match = WHERE_RE.search(query_upper)
+            found = {match.group(1) for match in WHERE_FUNCTION_RE.finditer(query_upper, where_match.end())}
+            for function in WHERE_FUNCTIONS:
+                if function in found:
+                    warnings.append(f"Function {function}( in WHERE clause may prevent index usage")
+        
+        return CheckResult(warnings=warnings, suggestions=suggestions)
     
     def _sanitize_query(self, query: str, parsed_query) -> str:
         """Sanitize the query by removing or escaping dangerous elements."""
         sanitized = query
         
-        # Remove comments (potential injection vector)
-        sanitized = re.sub(r'--.*$', '', sanitized, flags=re.MULTILINE)
-        sanitized = re.sub(r'/\*.*?\*/', '', sanitized, flags=re.DOTALL)
-        
-        # Normalize whitespace
-        sanitized = re.sub(r'\s+', ' ', sanitized).strip()
+        # Remove comments (potential injection vector) and normalize whitespace
+        sanitized = SANITIZE_RE.sub(' ', sanitized).strip()
         
         # Ensure query ends with semicolon
         if not sanitized.endswith(';'):
@@ -310,16 +534,8 @@ class SQLValidator:
     def check_column_references(self, query: str, available_columns: Set[str]) -> Dict[str, Any]:
         """Check if all referenced columns exist in the schema."""
         try:
-            parsed = sqlparse.parse(query)[0]
-            referenced_columns = set()
-            
-            # Extract column references (simplified approach)
-            for token in parsed.flatten():
-                if token.ttype is None and '.' in str(token):
-                    # Likely a table.column reference
-                    parts = str(token).split('.')
-                    if len(parts) == 2:
-                        referenced_columns.add(parts[1].strip('[]'))
+            parsed = parse_statements(query)[0]
+            referenced_columns = self._extract_qualified_columns(parsed)
             
             # Find missing columns
             missing_columns = referenced_columns - available_columns
@@ -332,7 +548,7 @@ class SQLValidator:
             }
             
         except Exception as e:
-            logger.error(f"Error checking column references: {e}")
+            logger.error("Error checking column references: {}", e)
             return {
                 "valid": False,
                 "error": str(e),
@@ -341,78 +557,107 @@ class SQLValidator:
                 "available_columns": list(available_columns)
             }
     
+    @staticmethod
+    def _extract_qualified_columns(token_list: sql.TokenList) -> Set[str]:
+        """Collect column names from table.column identifiers in a single walk of the parse tree.
+        
+        Identifiers after FROM/JOIN are table references (schema.table), not
+        columns; only subqueries inside them are searched.
+        """
+        columns = set()
+        pending = [token_list]
+        
+        while pending:
+            in_table_refs = False
+            for token in pending.pop().tokens:
+                if token.ttype in tokens.Keyword:
+                    in_table_refs = token.normalized == 'FROM' or token.normalized.endswith('JOIN')
+                elif not token.is_group:
+                    continue
+                elif in_table_refs and isinstance(token, (sql.Identifier, sql.IdentifierList)):
+                    # Schema-qualified table names: only look inside derived-table subqueries
+                    refs = [token]
+                    while refs:
+                        for sub in refs.pop().get_sublists():
+                            (pending if isinstance(sub, sql.Parenthesis) else refs).append(sub)
+                elif isinstance(token, sql.Identifier) and token.get_parent_name():
+                    column = token.get_real_name()
+                    if column and column != '*':
+                        columns.add(column.strip('[]`'))
+                else:
+                    pending.append(token)
+        
+        return columns
+    
     def format_query(self, query: str) -> str:
-        """Format SQL query for better readability."""
+        """Format SQL query for better readability.
+        
+        Short single-line statements are already readable, so they only get
+        their keywords upper-cased instead of a full sqlparse reindent.
+        """
         try:
-            formatted = sqlparse.format(
-                query,
-                reindent=True,
-                keyword_case='upper',
-                identifier_case='lower',
-                strip_comments=False,
-                use_space_around_operators=True
-            )
-            return formatted
+            if len(query) < 200 and '\n' not in query and query.count(';') <= 1:
+                return KEYWORD_CASE_RE.sub(lambda m: m.group(0) if m.group(1) is None else m.group(1).upper(), query)
+            return format_sql(query)
         except Exception as e:
-            logger.warning(f"Error formatting query: {e}")
+            logger.warning("Error formatting query: {}", e)
             return query
     
     def get_query_complexity_score(self, query: str) -> Dict[str, Any]:
         """Calculate a complexity score for the query."""
         try:
-            parsed = sqlparse.parse(query)[0]
-            query_upper = query.upper()
-            
-            complexity_score = 0
-            factors = {}
-            
-            # Count different complexity factors
-            factors['joins'] = query_upper.count('JOIN')
-            factors['subqueries'] = query_upper.count('SELECT') - 1  # Subtract main SELECT
-            factors['unions'] = query_upper.count('UNION')
-            factors['aggregations'] = sum(query_upper.count(func) for func in ['COUNT(', 'SUM(', 'AVG(', 'MAX(', 'MIN('])
-            factors['conditions'] = query_upper.count('WHERE') + query_upper.count('HAVING')
-            factors['case_statements'] = query_upper.count('CASE')
-            factors['window_functions'] = query_upper.count('OVER(')
-            
-            # Calculate weighted score
-            weights = {
-                'joins': 2,
-                'subqueries': 3,
-                'unions': 2,
-                'aggregations': 1,
-                'conditions': 1,
-                'case_statements': 2,
-                'window_functions': 3
-            }
-            
-            for factor, count in factors.items():
-                complexity_score += count * weights.get(factor, 1)
-            
-            # Determine complexity level
-            if complexity_score <= 5:
-                level = "simple"
-            elif complexity_score <= 15:
-                level = "moderate"
-            elif complexity_score <= 30:
-                level = "complex"
-            else:
-                level = "very_complex"
+            complexity_score, level, factors = self._score_complexity(query)
             
             return {
                 "complexity_score": complexity_score,
                 "complexity_level": level,
-                "factors": factors
+                "factors": dict(factors)
             }
             
         except Exception as e:
-            logger.error(f"Error calculating complexity score: {e}")
+            logger.error("Error calculating complexity score: {}", e)
             return {
                 "complexity_score": 0,
                 "complexity_level": "unknown",
                 "factors": {},
                 "error": str(e)
             }
+    
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _score_complexity(query: str) -> Tuple[int, str, Tuple[Tuple[str, int], ...]]:
+        """Score query complexity; memoized, so the result is immutable."""
+        parsed = parse_statements(query)[0]
+        keyword_counts = SQLValidator._count_keywords(query)
+        
+        counts = [0] * len(ComplexityFactor)
+        
+        # Count different complexity factors
+        counts[ComplexityFactor.JOINS] = keyword_counts['JOIN']
+        # SELECT keywords from the token stream - skips comments, string literals and identifiers
+        select_count = sum(1 for token in parsed.flatten() if token.ttype is tokens.DML and token.normalized == 'SELECT')
+        counts[ComplexityFactor.SUBQUERIES] = select_count - 1  # Subtract main SELECT
+        counts[ComplexityFactor.UNIONS] = keyword_counts['UNION']
+        counts[ComplexityFactor.AGGREGATIONS] = sum(keyword_counts[func] for func in ('COUNT(', 'SUM(', 'AVG(', 'MAX(', 'MIN('))
+        counts[ComplexityFactor.CONDITIONS] = keyword_counts['WHERE'] + keyword_counts['HAVING']
+        counts[ComplexityFactor.CASE_STATEMENTS] = keyword_counts['CASE']
+        counts[ComplexityFactor.WINDOW_FUNCTIONS] = keyword_counts['OVER(']
+        
+        # Calculate weighted score
+        complexity_score = sum(count * weight for count, weight in zip(counts, COMPLEXITY_WEIGHTS))
+        
+        # Determine complexity level
+        if complexity_score <= 5:
+            level = "simple"
+        elif complexity_score <= 15:
+            level = "moderate"
+        elif complexity_score <= 30:
+            level = "complex"
+        else:
+            level = "very_complex"
+        
+        factors = tuple((factor.name.lower(), counts[factor]) for factor in ComplexityFactor)
+        return complexity_score, level, factors
 
 
 def main():
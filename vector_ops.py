@@ -0,0 +1,38 @@
+"""Similarity kernels shared by the pattern matcher and the semantic cache.
+
+NL2MySQL v1.0 - IdentityIQ Natural Language to SQL Generator
+Developed by: Kuldeep Singh Rautela
+Contact: rautela.ks.job@gmail.com for commercial licensing
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def best_match(mat, q):
+        """Fused dot-product sweep + argmax over the rows of mat."""
+        n = mat.shape[0]
+        sims = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            s = np.float32(0.0)
+            for k in range(mat.shape[1]):
+                s += mat[i, k] * q[k]
+            sims[i] = s
+        best_idx = 0
+        for i in range(1, n):
+            if sims[i] > sims[best_idx]:
+                best_idx = i
+        return best_idx, sims[best_idx]
+else:
+    def best_match(mat, q):
+        """Dot-product sweep + argmax over the rows of mat."""
+        sims = mat @ q
+        best_idx = int(sims.argmax())
+        return best_idx, sims[best_idx]